@@ -0,0 +1,146 @@
+# Howto:
+# PYTHONPATH=. python3 scripts/benchmark.py [--entries 5000] [--latency 0.002] [--json results.json]
+#
+# Runs the hot paths of TogglPy against toggl.mockserver, a local stand-in for the
+# Toggl API, so no API key or network is needed:
+#   request       sequential GETs over a pooled keep-alive connection
+#   report        getDetailedReportPages with 1 and 4 workers, as dicts and as a TimeEntryBatch
+#   metadata      searchClientProject without cache, with the metadata cache and with the directory
+#   bulk          createTimeEntries with 1 and 4 workers
+#   sheets        report export to a FakeWorksheet, cell by cell and in blocks of rows
+# and prints latency percentiles, throughput and peak memory (tracemalloc) of each.
+# --latency delays every response to imitate the network, which is where concurrency pays off.
+# Save --json output of two revisions and compare them to catch regressions.
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+from toggl.mockserver import MockTogglServer
+from toggl.sheets import (
+    DEFAULT_COLUMNS, FakeWorksheet, cell_name, cell_value, export_report,
+)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(name, func, repeat=1, **info):
+    '''call func `repeat` times, returning latency percentiles, throughput and peak memory'''
+    samples = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = dict(info, name=name, calls=repeat, seconds=elapsed, per_second=repeat / elapsed,
+                  p50_ms=percentile(samples, 0.5) * 1000, p90_ms=percentile(samples, 0.9) * 1000,
+                  p99_ms=percentile(samples, 0.99) * 1000, peak_kb=peak / 1024.0)
+    print('%-34s %7d %10.1f %9.2f %9.2f %9.2f %10.0f' % (
+        name, repeat, result['per_second'], result['p50_ms'], result['p90_ms'], result['p99_ms'], result['peak_kb']))
+    return result
+
+
+def bench_request(server, args):
+    toggl = server.client()
+    return [run('request GET workspaces', toggl.getWorkspaces, repeat=args.requests)]
+
+
+def bench_report(server, args):
+    toggl = server.client()
+    data = {'workspace_id': 1, 'since': '2021-01-01', 'until': '2021-12-31'}
+    results = []
+    for workers in (1, 4):
+        for output in ('dict', 'batch'):
+            results.append(run('report %s, %d worker(s)' % (output, workers),
+                               lambda: toggl.getDetailedReportPages(data, workers=workers, output=output),
+                               repeat=args.rounds, entries=args.entries))
+    return results
+
+
+def bench_metadata(server, args):
+    names = ['Project 1-%d-%d' % (client, client % 5) for client in range(args.clients)]
+
+    def lookups(toggl):
+        for name in names:
+            toggl.searchClientProject(name)
+
+    results = [run('metadata search, no cache', lambda: lookups(server.client()), repeat=args.rounds)]
+    cached = server.client()
+    cached.enableMetadataCache()
+    results.append(run('metadata search, cache', lambda: lookups(cached), repeat=args.rounds))
+    indexed = server.client()
+    indexed.loadDirectory()
+    results.append(run('metadata search, directory', lambda: lookups(indexed), repeat=args.rounds))
+    return results
+
+
+def bench_bulk(server, args):
+    toggl = server.client()
+    entries = [{'hourduration': 1, 'description': 'bulk %d' % i, 'projectid': 100000, 'year': 2021, 'month': 6,
+                'day': 1 + i % 28, 'hour': 9} for i in range(args.bulk)]
+    return [run('bulk create, %d worker(s)' % workers, lambda: toggl.createTimeEntries(entries, workers=workers),
+                entries=len(entries)) for workers in (1, 4)]
+
+
+def bench_sheets(server, args):
+    toggl = server.client()
+    data = {'workspace_id': 1}
+
+    def cell_by_cell():
+        worksheet = FakeWorksheet(latency=args.sheet_latency)
+        for row, entry in enumerate(toggl.iterDetailedReport(data), 2):
+            for col, column in enumerate(DEFAULT_COLUMNS, 1):
+                worksheet.update_acell(cell_name(row, col), cell_value(entry[column]))
+
+    results = [run('sheets cell by cell', cell_by_cell, entries=args.entries)]
+    for block_size in (100, 1000):
+        results.append(run('sheets blocks of %d rows' % block_size,
+                           lambda: export_report(toggl, FakeWorksheet(latency=args.sheet_latency), data,
+                                                 block_size=block_size), entries=args.entries))
+    return results
+
+
+BENCHMARKS = {'request': bench_request, 'report': bench_report, 'metadata': bench_metadata, 'bulk': bench_bulk,
+              'sheets': bench_sheets}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TogglPy against a local mock Toggl API')
+    parser.add_argument('benchmarks', nargs='*', help='any of %s, default: all' % ', '.join(BENCHMARKS))
+    parser.add_argument('--entries', type=int, default=5000, help='time entries in the detailed report')
+    parser.add_argument('--clients', type=int, default=20, help='clients in the workspace, 5 projects each')
+    parser.add_argument('--requests', type=int, default=500, help='sequential requests to time')
+    parser.add_argument('--bulk', type=int, default=200, help='time entries to create')
+    parser.add_argument('--rounds', type=int, default=3, help='repetitions of the report and metadata runs')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--sheet-latency', type=float, default=0.0, help='seconds per FakeWorksheet call')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %r' % name)
+
+    results = []
+    with MockTogglServer(latency=args.latency, time_entries=args.entries, clients=args.clients) as server:
+        print('mock server %s, %d entries, latency %.1f ms' % (server.url, args.entries, args.latency * 1000))
+        print('%-34s %7s %10s %9s %9s %9s %10s' % ('benchmark', 'calls', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms',
+                                                   'peak kB'))
+        for name in args.benchmarks or BENCHMARKS:
+            results.extend(BENCHMARKS[name](server, args))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'latency': args.latency, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
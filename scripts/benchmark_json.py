@@ -0,0 +1,68 @@
+# Howto:
+# python3 scripts/benchmark_json.py [recorded_payload.json ...]
+#
+# Compares the JSON backends TogglPy can use (orjson, ujson, the standard library)
+# on recorded API responses, e.g. saved with
+# toggl.requestRaw(Endpoints.REPORT_DETAILED, data) written to a file.
+# Without arguments a synthetic detailed report page and a large report are used.
+
+import os
+import sys
+import time
+
+from toggl import codec
+
+
+def synthetic_report(entries):
+    return {
+        'total_count': entries, 'per_page': 50, 'total_grand': 3600000 * entries, 'total_billable': None,
+        'total_currencies': [{'currency': None, 'amount': None}],
+        'data': [{
+            'id': 1000000 + i, 'pid': 100 + i % 17, 'tid': None, 'uid': 10 + i % 5,
+            'description': 'Working on feature %d' % (i % 40), 'start': '2021-05-01T09:00:00+02:00',
+            'end': '2021-05-01T10:00:00+02:00', 'updated': '2021-05-01T10:00:05+02:00', 'dur': 3600000,
+            'user': 'User %d' % (i % 5), 'use_stop': True, 'client': 'Client %d' % (i % 7),
+            'project': 'Project %d' % (i % 17), 'project_color': '0', 'project_hex_color': '#06aaf5',
+            'task': None, 'billable': 25.0, 'is_billable': True, 'cur': 'EUR', 'tags': ['dev', 'review'],
+        } for i in range(entries)],
+    }
+
+
+def payloads(paths):
+    if paths:
+        for path in paths:
+            with open(path, 'rb') as f:
+                yield os.path.basename(path), f.read()
+    else:
+        yield 'report page (50 entries)', codec.dumps(synthetic_report(50))
+        yield 'report (10000 entries)', codec.dumps(synthetic_report(10000))
+
+
+def measure(func, argument, seconds=1.0):
+    '''return the mean seconds per call of func(argument), running it for about `seconds`'''
+    calls, started = 0, time.perf_counter()
+    while True:
+        func(argument)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return elapsed / calls
+
+
+def main():
+    backends = codec.available_backends()
+    print('backends: %s (default: %s)' % (', '.join(backends), codec.backend))
+    for name, raw in payloads(sys.argv[1:]):
+        print('\n%s, %.1f kB' % (name, len(raw) / 1024.0))
+        print('%-8s %12s %12s %12s' % ('backend', 'loads ms', 'dumps ms', 'loads MB/s'))
+        for backend in backends:
+            loads, dumps = codec.load_backend(backend)
+            obj = loads(raw)
+            decode = measure(loads, raw)
+            encode = measure(dumps, obj)
+            print('%-8s %12.3f %12.3f %12.1f' % (backend, decode * 1000, encode * 1000,
+                                                 len(raw) / decode / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -41,21 +41,34 @@ def get_entries(start, end, from_workspace_id, from_user_id):
     return entries
 
 
-def save_entries(entries, workspace_id, user_id, project_id, hourdiff_to_utc):
+def checkpoint_name(start, end, from_workspace_id, from_user_id, workspace_id, user_id):
+    '''one checkpoint file per source account, target account and date range'''
+    return 'clone_%s-%s_to_%s-%s_%s_%s.jsonl' % (from_workspace_id, from_user_id, workspace_id, user_id, start, end)
+
+
+def save_entries(entries, workspace_id, user_id, project_id, hourdiff_to_utc, checkpoint=None):
     toggl = Toggl()
 
     toggl.setAPIKey(os.getenv('TOGGL_APIKEY_TO'))
-    for entry in entries:
-        start = entry['start']
-        start_date = datetime.datetime.strptime(start, '%Y-%m-%dT%H:%M:%S%z')
-        y = start_date.year
-        m = start_date.month
-        d = start_date.day
-        h = start_date.hour
-        desc = entry['description']
-        print(entry['dur'])
-        toggl.createTimeEntry(round(entry['dur']/3600000.0, 1), description=desc, projectid=project_id, year=y,
-                              month=m, day=d, hour=h, hourdiff=hourdiff_to_utc)
+
+    def to_create(entry):
+        start_date = datetime.datetime.strptime(entry['start'], '%Y-%m-%dT%H:%M:%S%z')
+        return dict(hourduration=round(entry['dur']/3600000.0, 1), description=entry['description'],
+                    projectid=project_id, year=start_date.year, month=start_date.month, day=start_date.day,
+                    hour=start_date.hour, hourdiff=hourdiff_to_utc)
+
+    def progress(done, result):
+        print(done, len(entries), result.item['description'], 'skipped' if result.skipped else result.error or 'ok')
+
+    # entries already cloned by a previous, interrupted run are recorded in the checkpoint file and skipped,
+    # they are recognized by the id of the source entry
+    results = toggl.createTimeEntries(entries, prepare=to_create, key=lambda entry: entry['id'],
+                                      checkpoint=checkpoint, progress=progress)
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        print(result.error)
+    if failed:
+        raise failed[0].error
 
 
 def main():
@@ -70,7 +83,8 @@ def main():
 
     entries = get_entries(start, end, from_workspace_id, from_user_id)
     try:
-        save_entries(entries, workspace_id, user_id, project_id, hourdiff_to_utc)
+        checkpoint = checkpoint_name(start, end, from_workspace_id, from_user_id, workspace_id, user_id)
+        save_entries(entries, workspace_id, user_id, project_id, hourdiff_to_utc, checkpoint=checkpoint)
     except urllib.error.HTTPError as e:
         print(e.code)
         print(e.reason)
@@ -2,28 +2,33 @@
 TogglPy is a non-cluttered, easily understood and implemented
 library for interacting with the Toggl API.
 """
-import json  # parsing json data
 import math
-import sys
+import os
+import threading
 import time
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-
-# for making requests
-# backward compatibility with python2
-cafile = None
-if sys.version_info.major == 2:
-    from urllib import urlencode
-
-    from urllib2 import Request, urlopen
-else:
-    from urllib.parse import urlencode
-    from urllib.request import Request, urlopen
-    try:
-        import certifi
-        cafile = certifi.where()
-    except ImportError:
-        pass
+from itertools import chain
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+
+from toggl import codec
+from toggl.bulk import (
+    first_result, is_transient_request, is_unsent, run_bulk, run_grouped,
+)
+from toggl.cache import MISSING, MetadataCache
+from toggl.directory import TogglDirectory
+from toggl.metrics import (
+    MetricsCollector, RequestEvent, endpoint_label, endpoint_names,
+)
+from toggl.ratelimit import TokenBucket, retry_after
+from toggl.records import decode_entries
+from toggl.reportcache import ReportCache, merge_detailed, split_period
+from toggl.scheduler import BULK, INTERACTIVE, NORMAL, PriorityScheduler
+from toggl.singleflight import SingleFlight, request_key
+from toggl.transport import HTTPTransport
 
 
 # --------------------------------------------
@@ -40,17 +45,24 @@ class Endpoints():
     START_TIME = "https://api.track.toggl.com/api/v8/time_entries/start"
     TIME_ENTRIES = "https://api.track.toggl.com/api/v8/time_entries"
     CURRENT_RUNNING_TIME = "https://api.track.toggl.com/api/v8/time_entries/current"
+    ME = "https://api.track.toggl.com/api/v8/me"
 
     @staticmethod
     def STOP_TIME(id):
         return "https://api.track.toggl.com/api/v8/time_entries/" + str(id) + "/stop"
 
 
+# (url prefix, name) of every endpoint, used to label requests in metrics
+ENDPOINT_NAMES = endpoint_names(Endpoints)
+# JSON reports kept by the report cache
+REPORT_ENDPOINTS = (Endpoints.REPORT_WEEKLY, Endpoints.REPORT_DETAILED, Endpoints.REPORT_SUMMARY)
+
+
 # ------------------------------------------------------
 # Class containing the necessities for Toggl interaction
 # ------------------------------------------------------
 class Toggl():
-    # template of headers for our request
+    # template of headers for our request, every instance works on its own copy
     headers = {
         "Authorization": "",
         "Content-Type": "application/json",
@@ -61,12 +73,37 @@ class Toggl():
     # default API user agent value
     user_agent = "TogglPy"
 
+    # how many times a request answered with 429 Too Many Requests is retried
+    max_retries = 3
+
+    def __init__(self, transport=None):
+        # credentials are per instance, several accounts can be used side by side
+        self.headers = dict(type(self).headers)
+        # keep-alive connections are pooled by the transport and reused across requests
+        self.transport = transport if transport is not None else HTTPTransport()
+        # Toggl allows about one request per second per API token, with small bursts
+        self.rate_limiter = TokenBucket(rate=1.0, burst=3)
+        # opt-in cache for workspaces, clients, projects and tasks, see enableMetadataCache()
+        self.metadata_cache = None
+        # opt-in indexes answering lookups without API calls, see loadDirectory()
+        self.directory = None
+        # opt-in instrumentation, see enableMetrics() and addRequestHook()
+        self.metrics = None
+        self.request_hooks = []
+        # identical GETs made at the same time by several threads share one request, None disables it
+        self.single_flight = SingleFlight()
+        # opt-in disk cache for reports of closed periods, see enableReportCache()
+        self.report_cache = None
+        # opt-in priority classes for the rate limit, see enableScheduler() and priority()
+        self.scheduler = None
+        self._priority = threading.local()
+
     # ------------------------------------------------------------
     # Auxiliary methods
     # ------------------------------------------------------------
 
     def decodeJSON(self, jsonString):
-        return json.JSONDecoder().decode(jsonString)
+        return codec.loads(jsonString)
 
     # ------------------------------------------------------------
     # Methods that modify the headers to control our HTTP requests
@@ -79,6 +116,8 @@ class Toggl():
 
         # add it into the header
         self.headers['Authorization'] = authHeader
+        # indexes loaded with other credentials describe another account
+        self.directory = None
 
     def setAuthCredentials(self, email, password):
         authHeader = '{0}:{1}'.format(email, password)
@@ -86,54 +125,338 @@ class Toggl():
 
         # add it into the header
         self.headers['Authorization'] = authHeader
+        self.directory = None
 
     def setUserAgent(self, agent):
         '''set the User-Agent setting, by default it's set to TogglPy'''
         self.user_agent = agent
 
+    def setRateLimit(self, rate, burst=1):
+        '''
+        set how many requests per second may be sent, shared by every thread using this object
+        :param rate: sustained requests per second, None disables rate limiting
+        :param burst: number of requests that may be sent back to back
+        '''
+        self.rate_limiter = TokenBucket(rate, burst) if rate else None
+
+    # ------------------------------------------------
+    # Methods controlling the metadata (lookups) cache
+    # ------------------------------------------------
+
+    def enableMetadataCache(self, ttls=None, maxsize=256):
+        '''
+        cache workspaces, clients, projects and tasks so that repeated lookups skip the API,
+        cached data is invalidated when this object creates, updates or deletes clients and tasks
+        :param ttls: dict of seconds to live per resource ('workspaces', 'clients', 'projects', 'tasks')
+        :param maxsize: maximum number of cached responses
+        '''
+        self.metadata_cache = MetadataCache(ttls=ttls, maxsize=maxsize)
+        return self.metadata_cache
+
+    def disableMetadataCache(self):
+        self.metadata_cache = None
+
+    def invalidateMetadata(self, *resources):
+        '''drop cached data of the given resources, or all of it when none is given'''
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(*resources)
+
+    def loadDirectory(self):
+        '''
+        download all workspaces, clients and projects once and answer getWorkspace, getClient,
+        getClientProject and searchClientProject from in-memory indexes from now on,
+        call refresh() on the returned directory to pick up changes
+        '''
+        self.directory = TogglDirectory(self).load()
+        return self.directory
+
+    def enableMetrics(self):
+        '''
+        record per-endpoint request counts, latencies, bytes, retries, rate limit waits and cache hits,
+        read them with metrics.as_dict() or metrics.prometheus()
+        '''
+        self.metrics = MetricsCollector()
+        return self.metrics
+
+    def disableMetrics(self):
+        self.metrics = None
+
+    def addRequestHook(self, before=None, after=None):
+        '''
+        call `before(event)` before and `after(event)` after every HTTP exchange with a toggl.metrics.RequestEvent,
+        returns the hook to pass to removeRequestHook()
+        '''
+        hook = (before, after)
+        self.request_hooks.append(hook)
+        return hook
+
+    def removeRequestHook(self, hook):
+        self.request_hooks.remove(hook)
+
+    def enableScheduler(self, headroom=0):
+        '''
+        share the rate limit by priority: interactive calls (start, stop, current timer) get the next token,
+        bulk work (report pages, bulk updates and deletes) uses what is left
+        :param headroom: tokens of the burst bulk requests leave for more urgent ones
+        '''
+        if self.rate_limiter is None:
+            raise ValueError("the scheduler shares the rate limit, call setRateLimit() first")
+        if headroom >= self.rate_limiter.burst:
+            raise ValueError("headroom must be lower than the rate limit burst (%d)" % self.rate_limiter.burst)
+        self.scheduler = PriorityScheduler(headroom=headroom)
+        return self.scheduler
+
+    def disableScheduler(self):
+        self.scheduler = None
+
+    @contextmanager
+    def priority(self, name):
+        '''
+        send the requests made by this thread inside the block with a priority class,
+        'interactive', 'normal' or 'bulk', e.g. `with toggl.priority('bulk'): ...`
+        '''
+        previous = getattr(self._priority, 'name', None)
+        self._priority.name = name
+        try:
+            yield
+        finally:
+            self._priority.name = previous
+
+    def currentPriority(self, default=NORMAL):
+        '''the priority class set by priority() in this thread, or `default`'''
+        return getattr(self._priority, 'name', None) or default
+
+    def enableReportCache(self, path, max_bytes=256 * 1024 * 1024, settle_days=7):
+        '''
+        keep weekly, summary and detailed reports of periods that ended at least `settle_days` ago on disk,
+        they are then never requested again
+        :param path: cache directory
+        :param max_bytes: maximum size of the cache, least recently used reports are evicted first
+        '''
+        self.report_cache = ReportCache(path, max_bytes=max_bytes, settle_days=settle_days)
+        return self.report_cache
+
+    def disableReportCache(self):
+        self.report_cache = None
+
     # -----------------------------------------------------
     # Methods for directly requesting data from an endpoint
     # -----------------------------------------------------
 
+    def sendRequest(self, method, endpoint, body=None, headers=None, stream=False):
+        '''
+        send a request through the rate limiter, retrying when Toggl answers 429 Too Many Requests
+        :param headers: extra headers for this request only
+        :param stream: return a transport StreamResponse whose body has not been read yet
+        '''
+        send = self.transport.stream if stream else self.transport.request
+        headers = dict(self.headers, **headers) if headers else self.headers
+        observed = self.metrics is not None or self.request_hooks
+        attempt = 0
+        while True:
+            waited = self.acquireToken()
+            try:
+                if observed:
+                    return self.sendObserved(send, method, endpoint, body, headers, attempt, waited)
+                return send(method, endpoint, body=body, headers=headers)
+            except HTTPError as e:
+                if e.code != 429 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                wait = retry_after(e.headers)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.penalize(wait)
+                else:
+                    time.sleep(wait)
+
+    def acquireToken(self):
+        '''wait for the rate limiter, in priority order when the scheduler is enabled, returns the seconds waited'''
+        if self.rate_limiter is None:
+            return 0.0
+        if self.scheduler is None:
+            return self.rate_limiter.acquire()
+        priority = self.currentPriority()
+        waited = self.scheduler.acquire(self.rate_limiter, priority)
+        if self.metrics is not None:
+            self.metrics.record_scheduled(priority, waited, self.scheduler.queued(priority))
+        return waited
+
+    def sendObserved(self, send, method, endpoint, body, headers, attempt, waited):
+        '''send one request, reporting it to the request hooks and the metrics collector'''
+        event = RequestEvent(method, endpoint, endpoint_label(endpoint, ENDPOINT_NAMES), attempt, waited,
+                             len(body) if body else 0)
+        for before, _ in self.request_hooks:
+            if before is not None:
+                before(event)
+        started = time.perf_counter()
+        try:
+            response = send(method, endpoint, body=body, headers=headers)
+        except Exception as e:
+            event.status = getattr(e, 'code', None)
+            event.error = e
+            raise
+        else:
+            # a 304 answer is served with the status of the cached response, the network saw a 304
+            event.status = 304 if getattr(response, 'revalidated', False) else response.status
+            transferred = getattr(response, 'transferred', None)
+            if transferred is None:  # streamed, the body has not been read yet
+                event.bytes_received = int(response.headers.get('Content-Length') or 0)
+            else:
+                event.bytes_received = transferred
+            return response
+        finally:
+            event.seconds = time.perf_counter() - started
+            if self.metrics is not None:
+                self.metrics.record(event)
+            for _, after in self.request_hooks:
+                if after is not None:
+                    after(event)
+
+    def encodeURL(self, endpoint, parameters=None):
+        '''return the endpoint URL with the GET parameters (and our user agent) encoded in it'''
+        if parameters is None:
+            return endpoint
+        if 'user_agent' not in parameters:
+            parameters.update({'user_agent': self.user_agent})  # add our class-level user agent in there
+        return endpoint + "?" + urlencode(parameters)
+
     def requestRaw(self, endpoint, parameters=None):
         '''make a request to the toggle api at a certain endpoint and return the RAW page data (usually JSON)'''
-        if parameters is None:
-            return urlopen(Request(endpoint, headers=self.headers), cafile=cafile).read()
+        cache_key = None
+        cached = self.report_cache is not None and endpoint in REPORT_ENDPOINTS
+        if cached and self.report_cache.is_closed(endpoint, parameters):
+            cache_key = self.report_cache.key(endpoint, parameters, self.headers.get('Authorization'))
+            body = self.report_cache.get(cache_key)
+            if body is not None:
+                if self.metrics is not None:
+                    self.metrics.record_cache_hit(endpoint_label(endpoint, ENDPOINT_NAMES))
+                return body
+
+        def send():
+            return self.sendRequest('GET', self.encodeURL(endpoint, parameters)).body
+
+        if self.single_flight is None:
+            body = send()
         else:
-            if 'user_agent' not in parameters:
-                parameters.update({'user_agent': self.user_agent})  # add our class-level user agent in there
-            # encode all of our data for a get request & modify the URL
-            endpoint = endpoint + "?" + urlencode(parameters)
-            # make request and read the response
-            return urlopen(Request(endpoint, headers=self.headers), cafile=cafile).read()
+            body, shared = self.single_flight.do(request_key(endpoint, parameters, self.headers), send)
+            if shared and self.metrics is not None:
+                self.metrics.record_coalesced(endpoint_label(endpoint, ENDPOINT_NAMES))
+        if cache_key is not None:
+            self.report_cache.set(cache_key, body)
+        return body
+
+    def requestStream(self, endpoint, parameters=None, chunk_size=65536, compress=False):
+        '''
+        make a request to the toggle api at a certain endpoint and yield the RAW page data in chunks
+        :param compress: ask for a gzip transfer, chunks are decompressed on the fly
+        '''
+        headers = {'Accept-Encoding': 'gzip, deflate'} if compress else None
+        with self.sendRequest('GET', self.encodeURL(endpoint, parameters), headers=headers, stream=True) as response:
+            for chunk in response.iter_content(chunk_size):
+                yield chunk
+
+    def downloadRaw(self, endpoint, parameters=None, filename=None, fileobj=None, chunk_size=65536,
+                    compress=False, resume=False):
+        """
+        Stream the RAW page data of an endpoint to a file without holding it in memory
+        :param filename: path of the file to write
+        :param fileobj: binary file object to write to, instead of filename
+        :param compress: ask for a gzip transfer, decompressed on the fly
+        :param resume: when `filename` already exists, only ask for the bytes it is missing (HTTP Range),
+                       starting over if the server does not support ranges
+        :return: number of bytes written
+        """
+        url = self.encodeURL(endpoint, parameters)
+        offset, headers = self.downloadHeaders(filename, compress=compress, resume=resume)
+        try:
+            response = self.sendRequest('GET', url, headers=headers, stream=True)
+        except HTTPError as e:
+            if e.code == 416 and offset:  # Range Not Satisfiable, the file is already complete
+                return 0
+            raise
+
+        written = 0
+        with response:
+            if offset and response.status != 206:
+                offset = 0  # the whole body is coming again
+            target = fileobj if fileobj is not None else open(filename, 'ab' if offset else 'wb')
+            try:
+                for chunk in response.iter_content(chunk_size):
+                    target.write(chunk)
+                    written += len(chunk)
+            finally:
+                if fileobj is None:
+                    target.close()
+        return written
+
+    @staticmethod
+    def downloadHeaders(filename=None, compress=False, resume=False):
+        '''
+        return (offset, headers) of a download, offset being the number of bytes of `filename` already there
+        when resuming, and headers asking for the rest of it (HTTP Range) or for a compressed transfer
+        '''
+        offset = os.path.getsize(filename) if resume and filename and os.path.exists(filename) else 0
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        elif compress:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        return offset, headers
 
     def request(self, endpoint, parameters=None):
         '''make a request to the toggle api at a certain endpoint and return the page data as a parsed JSON dict'''
-        return json.loads(self.requestRaw(endpoint, parameters).decode('utf-8'))
+        return codec.loads(self.requestRaw(endpoint, parameters))
+
+    def requestMetadata(self, resource, endpoint):
+        '''GET a metadata endpoint, going through the metadata cache when it is enabled'''
+        if self.metadata_cache is None:
+            return self.request(endpoint)
+        # responses depend on the account, the same cache may see several credentials
+        key = (endpoint, self.headers.get('Authorization'))
+        value = self.metadata_cache.get(resource, key)
+        if self.metrics is not None:
+            self.metrics.record_cache(resource, value is not MISSING)
+        if value is MISSING:
+            value = self.request(endpoint)
+            self.metadata_cache.set(resource, key, value)
+        return value
+
+    def requestPages(self, endpoint, data, pages, workers=4):
+        '''
+        fetch several pages of a paginated endpoint concurrently and yield them in page order,
+        the rate limiter decides how fast requests actually go out
+        :param data: request parameters shared by every page
+        :param pages: iterable of page numbers
+        :param workers: maximum number of requests in flight
+        '''
+        priority = self.currentPriority(BULK)
+
+        def fetch(page):
+            with self.priority(priority):
+                return self.request(endpoint, parameters=dict(data, page=page))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page in executor.map(fetch, pages):
+                yield page
 
     def postRequest(self, endpoint, parameters=None, method='POST'):
         '''make a POST request to the toggle api at a certain endpoint and return the RAW page data (usually JSON)'''
         if method == 'DELETE':  # Calls to the API using the DELETE mothod return a HTTP response rather than JSON
-            return urlopen(Request(endpoint, headers=self.headers, method=method), cafile=cafile).code
+            return self.sendRequest(method, endpoint).code
         if parameters is None:
-            return urlopen(
-                Request(endpoint, headers=self.headers, method=method), cafile=cafile
-            ).read().decode('utf-8')
+            return self.sendRequest(method, endpoint).body.decode('utf-8')
         else:
-            data = json.JSONEncoder().encode(parameters)
-            binary_data = data.encode('utf-8')
+            binary_data = codec.dumps(parameters)
             # make request and read the response
-            return urlopen(
-                Request(endpoint, data=binary_data, headers=self.headers, method=method), cafile=cafile
-            ).read().decode('utf-8')
+            response = self.sendRequest(method, endpoint, body=binary_data)
+            return response.body.decode('utf-8')
 
     # ---------------------------------
     # Methods for managing Time Entries
     # ---------------------------------
 
-    def startTimeEntry(self, description, pid=None, tid=None):
-        '''starts a new Time Entry'''
-
+    def startTimeEntryData(self, description, pid=None, tid=None):
+        '''return the body of a startTimeEntry request'''
         data = {
             "time_entry": {
                 "created_with": self.user_agent,
@@ -145,18 +468,25 @@ class Toggl():
 
         if tid:
             data["time_entry"]["tid"] = tid
+        return data
 
-        response = self.postRequest(Endpoints.START_TIME, parameters=data)
+    def startTimeEntry(self, description, pid=None, tid=None):
+        '''starts a new Time Entry'''
+        data = self.startTimeEntryData(description, pid, tid)
+        with self.priority(self.currentPriority(INTERACTIVE)):
+            response = self.postRequest(Endpoints.START_TIME, parameters=data)
         return self.decodeJSON(response)
 
     def currentRunningTimeEntry(self):
         '''Gets the Current Time Entry'''
-        response = self.postRequest(Endpoints.CURRENT_RUNNING_TIME, method="GET")
+        with self.priority(self.currentPriority(INTERACTIVE)):
+            response = self.postRequest(Endpoints.CURRENT_RUNNING_TIME, method="GET")
         return response
 
     def stopTimeEntry(self, entryid):
         '''Stop the time entry'''
-        response = self.postRequest(Endpoints.STOP_TIME(entryid), method="PUT")
+        with self.priority(self.currentPriority(INTERACTIVE)):
+            response = self.postRequest(Endpoints.STOP_TIME(entryid), method="PUT")
         return response
 
     def createTimeEntry(self, hourduration, description=None, projectid=None, projectname=None,
@@ -176,18 +506,26 @@ class Toggl():
         :param hour: Taken from now() if not provided
         :return: response object from post call
         """
-        data = {
-            "time_entry": {}
-        }
-
         if not projectid:
             if projectname and clientname:
                 projectid = (self.getClientProject(clientname, projectname))['data']['id']
             elif projectname:
                 projectid = (self.searchClientProject(projectname))['data']['id']
             else:
-                print('Too many missing parameters for query')
-                exit(1)
+                raise ValueError("createTimeEntry needs a projectid or a projectname")
+
+        data = self.timeEntryData(hourduration, projectid, description=description, taskid=taskid, year=year,
+                                  month=month, day=day, hour=hour, billable=billable, hourdiff=hourdiff)
+        response = self.postRequest(Endpoints.TIME_ENTRIES, parameters=data)
+        return self.decodeJSON(response)
+
+    @staticmethod
+    def timeEntryData(hourduration, projectid, description=None, taskid=None, year=None, month=None, day=None,
+                      hour=None, billable=False, hourdiff=-2):
+        '''return the body of a createTimeEntry request, the parameters are those of createTimeEntry'''
+        data = {
+            "time_entry": {}
+        }
 
         if description:
             data['time_entry']['description'] = description
@@ -195,10 +533,11 @@ class Toggl():
         if taskid:
             data['time_entry']['tid'] = taskid
 
-        year = datetime.now().year if not year else year
-        month = datetime.now().month if not month else month
-        day = datetime.now().day if not day else day
-        hour = datetime.now().hour if not hour else hour
+        now = datetime.now()
+        year = now.year if not year else year
+        month = now.month if not month else month
+        day = now.day if not day else day
+        hour = now.hour if not hour else hour
 
         timestruct = datetime(year, month, day, hour + hourdiff).isoformat() + '.000Z'
         data['time_entry']['start'] = timestruct
@@ -206,21 +545,47 @@ class Toggl():
         data['time_entry']['pid'] = projectid
         data['time_entry']['created_with'] = 'NAME'
         data['time_entry']['billable'] = billable
+        return data
 
-        response = self.postRequest(Endpoints.TIME_ENTRIES, parameters=data)
-        return self.decodeJSON(response)
+    def createTimeEntries(self, entries, workers=4, retries=3, backoff=1.0, checkpoint=None, key=None,
+                          progress=None, prepare=None):
+        """
+        Create many time entries concurrently, under the rate limit
+        :param entries: iterable of dicts of createTimeEntry keyword arguments
+        :param workers: number of entries created in parallel
+        :param retries: how many times an entry is retried when its request could not be sent (connection failure),
+                        a create that timed out or failed with a 5xx may have been committed and is not retried,
+                        429 Too Many Requests is retried by sendRequest (max_retries)
+        :param backoff: seconds to wait before the first retry, doubled for every following one
+        :param checkpoint: path of a file recording created entries, entries found there are skipped on the next run
+        :param key: callable returning a stable key for an entry, defaults to its position in `entries`,
+                    always pass one with a checkpoint shared by runs over different entries
+        :param progress: callable receiving (number of finished entries, BulkResult) after each entry
+        :param prepare: callable turning an entry into createTimeEntry keyword arguments, so that `entries`
+                        (and `key`) can work on the original records, e.g. time entries copied from another account
+        :return: list of toggl.bulk.BulkResult, in the order of `entries`
+        """
+        def create(entry):
+            return self.createTimeEntry(**(prepare(entry) if prepare is not None else entry))
 
-    def putTimeEntry(self, parameters):
+        return run_bulk(create, entries, workers=workers, retries=retries, backoff=backoff, checkpoint=checkpoint,
+                        key=key, progress=progress, retry=is_unsent)
+
+    @staticmethod
+    def putTimeEntryEndpoint(parameters):
+        '''return the endpoint of a putTimeEntry request, checking that the parameters carry a valid id'''
         if 'id' not in parameters:
             raise Exception("An id must be provided in order to put a time entry")
         id = parameters['id']
         if type(id) is not int:
             raise Exception("Invalid id %s provided " % (id))
-        endpoint = Endpoints.TIME_ENTRIES + "/" + str(id)  # encode all of our data for a put request & modify the URL
-        data = json.JSONEncoder().encode({'time_entry': parameters}).encode('utf-8')
-        request = Request(endpoint, data=data, headers=self.headers, method='PUT')
+        return Endpoints.TIME_ENTRIES + "/" + str(id)
+
+    def putTimeEntry(self, parameters):
+        endpoint = self.putTimeEntryEndpoint(parameters)  # encode all of our data for a put request & modify the URL
+        data = codec.dumps({'time_entry': parameters})
 
-        return json.loads(urlopen(request).read())
+        return codec.loads(self.sendRequest('PUT', endpoint, body=data).body)
 
     def deleteTimeEntry(self, entryid):
         '''Delete the time entry'''
@@ -228,15 +593,79 @@ class Toggl():
         response = self.postRequest(endpoint, method='DELETE')
         return response
 
+    def updateTimeEntries(self, ids, changes, batch_size=100, workers=4, retries=3, backoff=1.0, progress=None):
+        """
+        Apply the same changes to many time entries, updating up to `batch_size` entries per request
+        :param ids: iterable of time entry ids
+        :param changes: time entry fields to set, e.g. {'pid': 123} or {'tags': ['billed'], 'tag_action': 'add'}
+        :param batch_size: number of ids sent in one bulk request (comma separated in the URL)
+        :param workers: number of requests in flight, the rate limiter decides how fast they actually go out
+        :param retries: how many times a request failing with a transient error (5xx, network) is retried,
+                        429 Too Many Requests is retried by sendRequest (max_retries)
+        :param backoff: seconds to wait before the first retry, doubled for every following one
+        :param progress: callable receiving (number of finished ids, BulkResult) after each id
+        :return: list of toggl.bulk.BulkResult, one per id in the order of `ids`, with the updated entry as response
+        """
+        body = codec.dumps({'time_entry': changes})
+        priority = self.currentPriority(BULK)
+
+        def update(group):
+            endpoint = Endpoints.TIME_ENTRIES + "/" + ",".join(str(id) for id in group)
+            with self.priority(priority):
+                updated = codec.loads(self.sendRequest('PUT', endpoint, body=body).body)['data']
+            if isinstance(updated, dict):  # a single id gets a single entry back
+                updated = [updated]
+            by_id = {entry['id']: entry for entry in updated}
+            return {id: by_id[int(id)] for id in group if int(id) in by_id}
+
+        return run_grouped(update, ids, batch_size, workers=workers, retries=retries, backoff=backoff,
+                           progress=progress, retry=is_transient_request)
+
+    def deleteTimeEntries(self, ids, workers=4, retries=3, backoff=1.0, progress=None):
+        """
+        Delete many time entries concurrently, under the rate limit
+        The API deletes one time entry per request, `workers` requests are kept in flight.
+        :param ids: iterable of time entry ids
+        :return: list of toggl.bulk.BulkResult, one per id in the order of `ids`, with the HTTP status as response
+        Other parameters are those of updateTimeEntries.
+        """
+        priority = self.currentPriority(BULK)
+
+        def delete(id):
+            with self.priority(priority):
+                return self.deleteTimeEntry(id)
+
+        return run_bulk(delete, ids, workers=workers, retries=retries, backoff=backoff, key=lambda id: id,
+                        progress=progress, retry=is_transient_request)
+
     # ----------------------------------
     # Methods for getting workspace data
     # ----------------------------------
+    def getMe(self, withRelatedData=False, since=None):
+        """
+        Return the current user, optionally with their workspaces, clients, projects, tasks and time entries
+        :param withRelatedData: include the related data
+        :param since: epoch, only return related data changed after that time
+        """
+        return self.request(Endpoints.ME, parameters=self.meParameters(withRelatedData, since))
+
+    @staticmethod
+    def meParameters(withRelatedData=False, since=None):
+        '''return the GET parameters of a getMe request'''
+        parameters = {'with_related_data': 'true' if withRelatedData else 'false'}
+        if since is not None:
+            parameters['since'] = int(since)
+        return parameters
+
     def getWorkspaces(self):
         '''return all the workspaces for a user'''
-        return self.request(Endpoints.WORKSPACES)
+        return self.requestMetadata('workspaces', Endpoints.WORKSPACES)
 
     def getWorkspace(self, name=None, id=None):
         '''return the first workspace that matches a given name or id'''
+        if self.directory is not None and (name is not None or id is not None):
+            return self.directory.workspace(name=name, id=id)
+
         workspaces = self.getWorkspaces()  # get all workspaces
 
         # if they give us nothing let them know we're not returning anything
@@ -262,7 +691,7 @@ class Toggl():
         :return: Projects object returned from endpoint
         """
 
-        return self.request(Endpoints.WORKSPACES + '/{0}'.format(id) + '/projects')
+        return self.requestMetadata('projects', Endpoints.WORKSPACES + '/{0}'.format(id) + '/projects')
 
     # -------------------------------
     # Methods for getting client data
@@ -270,10 +699,13 @@ class Toggl():
 
     def getClients(self):
         '''return all clients that are visable to a user'''
-        return self.request(Endpoints.CLIENTS)
+        return self.requestMetadata('clients', Endpoints.CLIENTS)
 
     def getClient(self, name=None, id=None):
         '''return the first workspace that matches a given name or id'''
+        if self.directory is not None and (name is not None or id is not None):
+            return self.directory.client(name=name, id=id)
+
         clients = self.getClients()  # get all clients
 
         # if they give us nothing let them know we're not returning anything
@@ -298,26 +730,46 @@ class Toggl():
         :param active: possible values true/false/both. By default true. If false, only archived projects are returned.
         :return: Projects object returned from endpoint
         """
-        return self.request(Endpoints.CLIENTS + '/{0}/projects?active={1}'.format(id, active))
+        return self.requestMetadata('projects', Endpoints.CLIENTS + '/{0}/projects?active={1}'.format(id, active))
 
-    def searchClientProject(self, name):
+    def searchClientProject(self, name, workers=1, strategy='clients'):
         """
         Provide only a projects name for query and search through entire available names
         WARNING: Takes a long time!
                  If client name is known, 'getClientProject' would be advised
         :param name: Desired Project's name
+        :param workers: number of lookups in flight, the match of the earliest client (or workspace) wins as with
+                        workers=1, and no lookup starts after it
+        :param strategy: 'clients' fetches the projects client by client, 'workspaces' workspace by workspace
+                         (one request per workspace), 'auto' picks whichever needs fewer requests
         :return: Project object
         """
-        for client in self.getClients():
-            try:
-                for project in self.getClientProjects(client['id']):
-                    if project['name'] == name:
-                        return project
-            except Exception:
-                continue
+        if self.directory is not None:
+            project = self.directory.project(name=name)
+            if project is None:
+                print('Could not find client by the name')
+            return project
+
+        def match(projects):
+            return next((project for project in projects or () if project['name'] == name), None)
+
+        if strategy not in ('clients', 'workspaces', 'auto'):
+            raise ValueError("strategy must be 'clients', 'workspaces' or 'auto', not %r" % (strategy,))
+        clients = self.getClients() if strategy != 'workspaces' else None
+        workspaces = self.getWorkspaces() if strategy != 'clients' else None
+        if strategy == 'auto':
+            strategy = 'workspaces' if len(workspaces or ()) < len(clients or ()) else 'clients'
+
+        if strategy == 'clients':
+            project = first_result(lambda client: match(self.getClientProjects(client['id'])), clients or (),
+                                   workers=workers)
+        else:
+            project = first_result(lambda workspace: match(self.getWorkspaceProjects(workspace['id'])),
+                                   workspaces or (), workers=workers)
 
-        print('Could not find client by the name')
-        return None
+        if project is None:
+            print('Could not find client by the name')
+        return project
 
     def getClientProject(self, clientName, projectName):
         """
@@ -326,6 +778,16 @@ class Toggl():
         :param projectName:
         :return:
         """
+        if self.directory is not None:
+            if self.directory.client(name=clientName) is None:
+                print('Could not find such client name')
+                return None
+            project = self.directory.project(name=projectName, clientName=clientName)
+            if project is None:
+                print('Could not find such project name')
+                return None
+            return {'data': project}
+
         for client in self.getClients():
             if client['name'] == clientName:
                 cid = client['id']
@@ -349,7 +811,7 @@ class Toggl():
     # --------------------------------
     def getProject(self, pid):
         '''return all projects that are visable to a user'''
-        return self.request(Endpoints.PROJECTS + '/{0}'.format(pid))
+        return self.requestMetadata('projects', Endpoints.PROJECTS + '/{0}'.format(pid))
 
     def getProjectTasks(self, pid, archived=False):
         """
@@ -357,7 +819,7 @@ class Toggl():
         :param pid: Project ID
         :param archived: choose wether to fetch archived tasks or not
         """
-        return self.request(Endpoints.PROJECTS + '/{0}'.format(pid) + '/tasks')
+        return self.requestMetadata('tasks', Endpoints.PROJECTS + '/{0}'.format(pid) + '/tasks')
 
     # --------------------------------
     # Methods for interacting with TASKS data
@@ -380,76 +842,128 @@ class Toggl():
         data['task']['estimated_seconds'] = estimatedSeconds
 
         response = self.postRequest(Endpoints.TASKS, parameters=data)
+        self.invalidateMetadata('tasks')
         return self.decodeJSON(response)
 
     # --------------------------------
     # Methods for getting reports data
     # ---------------------------------
+    @staticmethod
+    def countPages(report):
+        '''return the number of pages of a paginated report, given its first page'''
+        try:
+            return int(math.ceil(report.get('total_count', 0) / float(report.get('per_page', 0))))
+        except ZeroDivisionError:
+            return 0
+
     def getWeeklyReport(self, data):
         '''return a weekly report for a user'''
         return self.request(Endpoints.REPORT_WEEKLY, parameters=data)
 
-    def getWeeklyReportPDF(self, data, filename):
+    def getWeeklyReportPDF(self, data, filename, resume=False):
         '''save a weekly report as a PDF'''
-        # get the raw pdf file data
-        filedata = self.requestRaw(Endpoints.REPORT_WEEKLY + ".pdf", parameters=data)
-
-        # write the data to a file
-        with open(filename, "wb") as pdf:
-            pdf.write(filedata)
-
-    def getDetailedReport(self, data):
-        '''return a detailed report for a user'''
-        return self.request(Endpoints.REPORT_DETAILED, parameters=data)
-
-    def getDetailedReportPages(self, data):
-        '''return detailed report data from all pages for a user'''
-        pages_index = 1
-        data['page'] = pages_index
-        pages = self.request(Endpoints.REPORT_DETAILED, parameters=data)
-        try:
-            pages_number = math.ceil(pages.get('total_count', 0) / pages.get('per_page', 0))
-        except ZeroDivisionError:
-            pages_number = 0
-        for pages_index in range(2, pages_number + 1):
-            time.sleep(1)  # There is rate limiting of 1 request per second (per IP per API token).
-            data['page'] = pages_index
-            pages['data'].extend(self.request(Endpoints.REPORT_DETAILED, parameters=data).get('data', []))
+        # stream the raw pdf file data to the file
+        self.downloadRaw(Endpoints.REPORT_WEEKLY + ".pdf", parameters=data, filename=filename, resume=resume)
+
+    def getDetailedReport(self, data, output='dict'):
+        '''
+        return a detailed report for a user
+        :param output: 'dict' for raw JSON entries, 'entries' for toggl.records.TimeEntry objects or
+                       'batch' for a columnar toggl.records.TimeEntryBatch, in the 'data' key of the report
+        '''
+        report = self.request(Endpoints.REPORT_DETAILED, parameters=data)
+        if output != 'dict':
+            report['data'] = decode_entries(report.get('data') or [], output)
+        return report
+
+    def getDetailedReportPages(self, data, workers=4, output='dict'):
+        '''
+        return detailed report data from all pages for a user, fetching up to `workers` pages at a time
+        :param output: 'dict', 'entries' or 'batch', see getDetailedReport
+        '''
+        periods = split_period(data, self.report_cache.closed_until()) if self.report_cache is not None else None
+        if periods is not None:
+            # the closed part comes from the report cache, only the open part is requested
+            closed, live = (self.getDetailedReportPages(period, workers, output) for period in periods)
+            return merge_detailed(closed, live, descending=data.get('order_desc') == 'on')
+
+        with self.priority(self.currentPriority(BULK)):
+            pages = self.request(Endpoints.REPORT_DETAILED, parameters=dict(data, page=1))
+        pages_number = self.countPages(pages)
+        rest = ()
+        if pages_number > 1:
+            rest = self.requestPages(Endpoints.REPORT_DETAILED, data, range(2, pages_number + 1), workers=workers)
+        if output == 'dict':
+            pages['data'] = list(chain(pages['data'], *(page.get('data', []) for page in rest)))
+        else:
+            # convert page by page so that only one page of dicts is alive at a time
+            interned = {}
+            entries = decode_entries(pages.get('data') or [], output, interned=interned)
+            pages['data'] = None
+            for page in rest:
+                decode_entries(page.get('data') or [], output, into=entries, interned=interned)
+            pages['data'] = entries
         return pages
 
-    def getDetailedReportPDF(self, data, filename):
+    def iterDetailedReport(self, data, prefetch=True):
+        """
+        Yield the time entries of a detailed report page by page, so that only one page is held in memory
+        :param data: report parameters, as for getDetailedReport
+        :param prefetch: fetch the next page in the background while the caller consumes the current one
+        :return: generator of time entry dicts
+        """
+        priority = self.currentPriority(BULK)
+
+        def fetch(page):
+            with self.priority(priority):
+                return self.request(Endpoints.REPORT_DETAILED, parameters=dict(data, page=page))
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page_index = 1
+            page = fetch(page_index)
+            pages_number = self.countPages(page)
+            while True:
+                following = None
+                if executor is not None and page_index < pages_number:
+                    following = executor.submit(fetch, page_index + 1)
+                entries = page.get('data', [])
+                page = None  # let the page go as soon as its entries are consumed
+                for entry in entries:
+                    yield entry
+                if page_index >= pages_number or not entries:
+                    break
+                page_index += 1
+                page = following.result() if following is not None else fetch(page_index)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def getDetailedReportPDF(self, data, filename, resume=False):
         '''save a detailed report as a pdf'''
-        # get the raw pdf file data
-        filedata = self.requestRaw(Endpoints.REPORT_DETAILED + ".pdf", parameters=data)
-
-        # write the data to a file
-        with open(filename, "wb") as pdf:
-            pdf.write(filedata)
-
-    def getDetailedReportCSV(self, data, filename=None):
-        '''save a detailed report as a csv'''
-        # get the raw pdf file data
-        filedata = self.requestRaw(Endpoints.REPORT_DETAILED + ".csv", parameters=data)
-
-        if filename:
-            # write the data to a file
-            with open(filename, "wb") as pdf:
-                pdf.write(filedata)
+        # stream the raw pdf file data to the file
+        self.downloadRaw(Endpoints.REPORT_DETAILED + ".pdf", parameters=data, filename=filename, resume=resume)
+
+    def getDetailedReportCSV(self, data, filename=None, fileobj=None, compress=False, resume=False):
+        '''
+        save a detailed report as a csv, streamed to `filename` or the binary file object `fileobj`,
+        the csv data is returned when neither is given
+        '''
+        if filename or fileobj is not None:
+            self.downloadRaw(Endpoints.REPORT_DETAILED + ".csv", parameters=data, filename=filename,
+                             fileobj=fileobj, compress=compress, resume=resume)
         else:
-            return filedata
+            return b''.join(self.requestStream(Endpoints.REPORT_DETAILED + ".csv", parameters=data,
+                                               compress=compress))
 
     def getSummaryReport(self, data):
         '''return a summary report for a user'''
         return self.request(Endpoints.REPORT_SUMMARY, parameters=data)
 
-    def getSummaryReportPDF(self, data, filename):
+    def getSummaryReportPDF(self, data, filename, resume=False):
         '''save a summary report as a pdf'''
-        # get the raw pdf file data
-        filedata = self.requestRaw(Endpoints.REPORT_SUMMARY + ".pdf", parameters=data)
-
-        # write the data to a file
-        with open(filename, "wb") as pdf:
-            pdf.write(filedata)
+        # stream the raw pdf file data to the file
+        self.downloadRaw(Endpoints.REPORT_SUMMARY + ".pdf", parameters=data, filename=filename, resume=resume)
 
     # --------------------------------
     # Methods for creating, updating, and deleting clients
@@ -469,6 +983,7 @@ class Toggl():
         data['client']['notes'] = notes
 
         response = self.postRequest(Endpoints.CLIENTS, parameters=data)
+        self.invalidateMetadata('clients')
         return self.decodeJSON(response)
 
     def updateClient(self, id, name=None, notes=None):
@@ -486,6 +1001,7 @@ class Toggl():
         data['client']['notes'] = notes
 
         response = self.postRequest(Endpoints.CLIENTS + '/{0}'.format(id), parameters=data, method='PUT')
+        self.invalidateMetadata('clients')
         return self.decodeJSON(response)
 
     def deleteClient(self, id):
@@ -494,4 +1010,5 @@ class Toggl():
         :param id: The id of the client to delete
         """
         response = self.postRequest(Endpoints.CLIENTS + '/{0}'.format(id), method='DELETE')
+        self.invalidateMetadata('clients', 'projects')
         return response
@@ -0,0 +1,193 @@
+"""
+Local summary and weekly rollups of detailed report entries.
+
+Every call to getSummaryReport or getWeeklyReport is a rate limited round
+trip. Once the detailed entries are downloaded (getDetailedReportPages,
+iterDetailedReport or a toggl.sync.SyncStore), any number of groupings can be
+computed locally from a toggl.records.TimeEntryBatch. When NumPy is installed
+the grouping runs vectorized over the batch columns (np.unique + np.bincount),
+otherwise a plain Python loop gives the same results.
+"""
+from datetime import date
+
+from toggl.records import MISSING, STRING_FIELDS, TimeEntryBatch
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# keys entries can be grouped by
+GROUP_KEYS = ('user', 'project', 'client', 'task', 'description', 'tag', 'day', 'week')
+DAY = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def as_batch(entries):
+    '''accept a TimeEntryBatch or any iterable of report dicts / TimeEntry objects'''
+    return entries if isinstance(entries, TimeEntryBatch) else TimeEntryBatch.from_entries(entries)
+
+
+def day_label(day):
+    return date.fromordinal(EPOCH_ORDINAL + int(day)).isoformat()
+
+
+class Columns():
+    '''the batch columns needed for grouping, one row per entry or per (entry, tag) when grouping by tag'''
+
+    def __init__(self, batch, explode_tags=False, use_numpy=True):
+        self.batch = batch
+        self.np = numpy if use_numpy else None
+        index = list(range(len(batch)))
+        tag_codes = None
+        if explode_tags:
+            index, tag_codes = [], []
+            tags = batch.columns['tags']
+            for row in range(len(batch)):
+                entry_tags = batch.strings[tags[row]] if tags[row] != MISSING else ()
+                for tag in entry_tags or (None,):
+                    index.append(row)
+                    tag_codes.append(batch.code(tag))
+        self.index = self.array(index)
+        self.tag_codes = self.array(tag_codes) if tag_codes is not None else None
+
+    def array(self, values):
+        return self.np.asarray(values, dtype='int64') if self.np is not None else list(values)
+
+    def take(self, name, dtype='int64'):
+        column = self.batch.columns[name]
+        if self.np is not None:
+            return self.np.asarray(column, dtype=dtype)[self.index]
+        return [column[row] for row in self.index]
+
+    def local_days(self):
+        '''day number (days since 1970-01-01) of each start, in the timezone of the entry'''
+        start, offset = self.take('start'), self.take('offset')
+        if self.np is not None:
+            return (start + offset) // DAY
+        return [(s + o) // DAY for s, o in zip(start, offset)]
+
+    def key(self, name):
+        '''return (per row codes, function turning a code into the group label)'''
+        strings = self.batch.strings
+        if name == 'tag':
+            return self.tag_codes, lambda code: None if code == MISSING else strings[code]
+        if name in ('day', 'week'):
+            days = self.local_days()
+            if name == 'week':  # monday of the week, 1970-01-01 was a thursday
+                days = days - (days + 3) % 7 if self.np is not None else [day - (day + 3) % 7 for day in days]
+            return days, day_label
+        if name in STRING_FIELDS:
+            return self.take(name), lambda code: None if code == MISSING else strings[code]
+        raise ValueError("cannot group by %r, use one of %s" % (name, ', '.join(GROUP_KEYS)))
+
+
+def group(columns, keys, values):
+    '''
+    sum each of `values` (dict of name -> per row numbers) per distinct combination of `keys` (list of code columns),
+    returns a list of (codes tuple, {name: total}, row count)
+    '''
+    np = columns.np
+    if np is not None:
+        if not len(columns.index):
+            return []
+        stacked = np.stack([np.asarray(key, dtype='int64') for key in keys], axis=1)
+        distinct, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(distinct))
+        sums = {name: np.bincount(inverse, weights=value, minlength=len(distinct)) for name, value in values.items()}
+        return [
+            (tuple(int(code) for code in distinct[group_index]),
+             {name: total[group_index].item() for name, total in sums.items()},
+             int(counts[group_index]))
+            for group_index in range(len(distinct))
+        ]
+
+    groups = {}
+    for row in range(len(columns.index)):
+        codes = tuple(key[row] for key in keys)
+        totals = groups.get(codes)
+        if totals is None:
+            totals = groups[codes] = [dict.fromkeys(values, 0), 0]
+        for name, value in values.items():
+            totals[0][name] += value[row]
+        totals[1] += 1
+    return [(codes, totals, count) for codes, (totals, count) in groups.items()]
+
+
+def measures(columns):
+    '''per row durations (ms), billable durations and billable amounts'''
+    dur = columns.take('dur')
+    is_billable = columns.take('is_billable')
+    amount = columns.take('billable', dtype='float64')
+    np = columns.np
+    if np is not None:
+        dur = np.where(dur == MISSING, 0, dur)
+        return {'time': dur, 'billable_time': dur * (is_billable != 0), 'billable': amount}
+    dur = [0 if value == MISSING else value for value in dur]
+    return {'time': dur, 'billable_time': [d if b else 0 for d, b in zip(dur, is_billable)], 'billable': amount}
+
+
+def summary(entries, by=('project',), use_numpy=True):
+    '''
+    Group entries like the summary report
+    :param entries: TimeEntryBatch, or iterable of report dicts or TimeEntry objects
+    :param by: group keys, any of user, project, client, task, description, tag, day and week
+    :param use_numpy: set to False to force the plain Python implementation
+    :return: list of dicts with the group keys, 'time' and 'billable_time' in milliseconds, the 'billable'
+             amount and the entry 'count', longest time first
+    '''
+    by = (by,) if isinstance(by, str) else tuple(by)
+    columns = Columns(as_batch(entries), explode_tags='tag' in by, use_numpy=use_numpy)
+    keys = [columns.key(name) for name in by]
+    rows = []
+    for codes, totals, count in group(columns, [key[0] for key in keys], measures(columns)):
+        row = {name: label(code) for name, (_, label), code in zip(by, keys, codes)}
+        row['time'] = int(totals['time'])
+        row['billable_time'] = int(totals['billable_time'])
+        row['billable'] = round(totals['billable'], 2)
+        row['count'] = count
+        rows.append(row)
+    rows.sort(key=lambda row: (-row['time'], tuple(str(row[name]) for name in by)))
+    return rows
+
+
+def weekly(entries, by='project', week_start=None, use_numpy=True):
+    '''
+    Group entries like the weekly report, one row per group with the time of each day of the week
+    :param entries: TimeEntryBatch, or iterable of report dicts or TimeEntry objects
+    :param by: group key, as for summary()
+    :param week_start: date of the first day, defaults to the monday of the earliest entry
+    :param use_numpy: set to False to force the plain Python implementation
+    :return: list of dicts with the group key and 'totals', 7 daily times plus the week total in milliseconds
+    '''
+    batch = as_batch(entries)
+    columns = Columns(batch, explode_tags=by == 'tag', use_numpy=use_numpy)
+    if not len(columns.index):
+        return []
+    days = columns.local_days()
+    if week_start is None:
+        first = int(min(days))
+        first_day = first - (first + 3) % 7
+    else:
+        first_day = week_start.toordinal() - EPOCH_ORDINAL
+    weekday = days - first_day if columns.np is not None else [day - first_day for day in days]
+
+    codes, label = columns.key(by)
+    values = measures(columns)
+    if columns.np is not None:
+        in_week = (weekday >= 0) & (weekday < 7)
+        values = {'time': values['time'] * in_week}
+        weekday = columns.np.clip(weekday, 0, 6)
+    else:
+        values = {'time': [time if 0 <= day < 7 else 0 for time, day in zip(values['time'], weekday)]}
+        weekday = [min(max(day, 0), 6) for day in weekday]
+
+    rows = {}
+    for (code, day), totals, _ in group(columns, [codes, weekday], values):
+        row = rows.setdefault(code, [0] * 8)
+        row[day] += int(totals['time'])
+        row[7] += int(totals['time'])
+    result = [{by: label(code), 'totals': totals} for code, totals in rows.items() if totals[7]]
+    result.sort(key=lambda row: (-row['totals'][7], str(row[by])))
+    return result
@@ -0,0 +1,520 @@
+"""
+Asyncio flavour of TogglPy.
+
+AsyncToggl exposes the methods of toggl.TogglPy.Toggl as coroutines. Requests
+go through AsyncHTTPTransport, a small non-blocking HTTP/1.1 client keeping
+keep-alive connections per host, so a single event loop can keep thousands of
+requests in flight across workspaces and API tokens.
+"""
+import asyncio
+import email.parser
+import http.client
+import io
+import time
+import weakref
+from collections import deque
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+from toggl import codec
+from toggl.bulk import is_unsent, run_bulk_async
+from toggl.ratelimit import TokenBucket, retry_after
+from toggl.TogglPy import Endpoints, Toggl
+from toggl.transport import (
+    IDEMPOTENT_METHODS, STALE_CONNECTION_ERRORS, ConnectionFailed, Response,
+    ValidatorCache, decode_body, default_ssl_context,
+)
+
+
+class AsyncHTTPTransport():
+    '''
+    Non-blocking HTTP/1.1 client with per host keep-alive connection pools.
+    :param pool_size: maximum number of idle connections kept per host
+    :param idle_timeout: seconds after which an idle connection is discarded instead of reused
+    :param timeout: seconds a whole request may take
+    :param ssl_context: SSL context for https connections, shared module default if not provided
+    :param compress: ask for gzip/deflate compressed responses
+    :param validators: ValidatorCache for conditional GETs, one is created by default, False disables them
+    '''
+
+    def __init__(self, pool_size=100, idle_timeout=60, timeout=30, ssl_context=None, compress=True, validators=None):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.compress = compress
+        self.validators = ValidatorCache() if validators is None else validators or None
+        self.ssl_context = ssl_context
+        self.created = 0  # number of connections opened
+        self._idle = {}  # (scheme, host, port) -> deque of (reader, writer, time returned)
+
+    async def _connect(self, scheme, host, port):
+        '''return (reader, writer, reused), taking an idle connection when one is still fresh'''
+        idle = self._idle.get((scheme, host, port))
+        now = time.monotonic()
+        while idle:
+            reader, writer, returned_at = idle.pop()
+            if now - returned_at <= self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        self.created += 1
+        try:
+            if scheme == 'https':
+                reader, writer = await asyncio.open_connection(
+                    host, port or 443, ssl=self.ssl_context or default_ssl_context()
+                )
+            else:
+                reader, writer = await asyncio.open_connection(host, port or 80)
+        except OSError as e:
+            raise ConnectionFailed(e) from e
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        idle = self._idle.setdefault(key, deque())
+        if len(idle) < self.pool_size:
+            idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader, method, status, headers):
+        '''read the response body, returns (body, connection can be reused)'''
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return b'', True
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)  # CRLF after each chunk
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # trailers
+            return b''.join(chunks), True
+        if headers.get('Content-Length') is not None:
+            return await reader.readexactly(int(headers['Content-Length'])), True
+        return await reader.read(), False
+
+    async def _exchange(self, reader, writer, method, host, path, body, headers):
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % host]
+        if body is not None or method in ('POST', 'PUT', 'PATCH'):
+            lines.append('Content-Length: %d' % len(body or b''))
+        lines.extend('%s: %s' % (name, value) for name, value in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line.decode('latin-1'))
+        response_headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(''.join(header_lines))
+        data, reusable = await self._read_body(reader, method, int(status), response_headers)
+        if version == 'HTTP/1.0' or response_headers.get('Connection', '').lower() == 'close':
+            reusable = False
+        return int(status), reason, response_headers, data, reusable
+
+    async def request(self, method, url, body=None, headers=None):
+        '''
+        perform a request and return a toggl.transport.Response with a decompressed body,
+        raising urllib's HTTPError for 4xx/5xx statuses like the blocking transport
+        '''
+        headers = dict(headers or {})
+        if self.compress and 'Accept-Encoding' not in headers:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        cached, cache_key = None, None
+        if method == 'GET' and self.validators is not None and 'Range' not in headers:
+            cache_key = (url, headers.get('Authorization'))
+            cached, conditions = self.validators.conditional_headers(cache_key)
+            if cached is not None:
+                headers.update(conditions)
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        while True:
+            reader, writer, reused = await self._connect(*key)
+            try:
+                status, reason, response_headers, data, reusable = await asyncio.wait_for(
+                    self._exchange(reader, writer, method, parts.netloc, path, body, headers), self.timeout
+                )
+            except STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,):
+                writer.close()
+                if reused and method in IDEMPOTENT_METHODS:
+                    continue  # the server dropped an idle connection, retry on a fresh one
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        if reusable:
+            self._release(key, reader, writer)
+        else:
+            writer.close()
+
+        if status == 304 and cached is not None:
+            self.validators.hit()
+            return Response(url, cached.status, cached.reason, cached.headers, cached.body, transferred=len(data),
+                            revalidated=True)
+        if status >= 400:
+            raise HTTPError(url, status, reason, response_headers, io.BytesIO(decode_body(response_headers, data)))
+        response = Response(url, status, reason, response_headers, decode_body(response_headers, data),
+                            transferred=len(data))
+        if cache_key is not None:
+            self.validators.store(cache_key, response)
+        return response
+
+    async def close(self):
+        '''close every idle connection'''
+        for idle in self._idle.values():
+            while idle:
+                idle.pop()[1].close()
+
+
+class AsyncToggl():
+    '''
+    Coroutine based counterpart of Toggl, every API method has to be awaited.
+    :param transport: AsyncHTTPTransport used to send requests
+    :param max_concurrency: maximum number of requests in flight per API token
+    '''
+
+    # template of headers for our requests, every instance works on its own copy
+    headers = Toggl.headers
+
+    # default API user agent value
+    user_agent = "TogglPy"
+
+    # how many times a request answered with 429 Too Many Requests is retried
+    max_retries = 3
+
+    # requests in flight per event loop and Authorization header, shared by every AsyncToggl using the same token
+    token_semaphores = weakref.WeakKeyDictionary()
+
+    def __init__(self, transport=None, max_concurrency=10):
+        self.headers = dict(type(self).headers)
+        self.transport = transport if transport is not None else AsyncHTTPTransport()
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(rate=1.0, burst=3)
+
+    # the header handling and the building of endpoints and request bodies are the same as for the blocking client
+    setAPIKey = Toggl.setAPIKey
+    setAuthCredentials = Toggl.setAuthCredentials
+    setUserAgent = Toggl.setUserAgent
+    setRateLimit = Toggl.setRateLimit
+    encodeURL = Toggl.encodeURL
+    startTimeEntryData = Toggl.startTimeEntryData
+    countPages = staticmethod(Toggl.countPages)
+    downloadHeaders = staticmethod(Toggl.downloadHeaders)
+    timeEntryData = staticmethod(Toggl.timeEntryData)
+    putTimeEntryEndpoint = staticmethod(Toggl.putTimeEntryEndpoint)
+    meParameters = staticmethod(Toggl.meParameters)
+
+    def decodeJSON(self, jsonString):
+        return codec.loads(jsonString)
+
+    def semaphore(self):
+        '''return the semaphore bounding the requests in flight for the current API token'''
+        semaphores = self.token_semaphores.setdefault(asyncio.get_running_loop(), {})
+        key = self.headers['Authorization']
+        if key not in semaphores:
+            semaphores[key] = asyncio.Semaphore(self.max_concurrency)
+        return semaphores[key]
+
+    # -----------------------------------------------------
+    # Methods for directly requesting data from an endpoint
+    # -----------------------------------------------------
+
+    async def sendRequest(self, method, endpoint, body=None, headers=None):
+        '''
+        send a request through the rate limiter, retrying when Toggl answers 429 Too Many Requests
+        :param headers: extra headers for this request only
+        '''
+        headers = dict(self.headers, **headers) if headers else self.headers
+        attempt = 0
+        async with self.semaphore():
+            while True:
+                if self.rate_limiter is not None:
+                    delay = self.rate_limiter.reserve()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                try:
+                    return await self.transport.request(method, endpoint, body=body, headers=headers)
+                except HTTPError as e:
+                    if e.code != 429 or attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    wait = retry_after(e.headers)
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.penalize(wait)
+                    else:
+                        await asyncio.sleep(wait)
+
+    async def requestRaw(self, endpoint, parameters=None):
+        '''make a request to the toggle api at a certain endpoint and return the RAW page data (usually JSON)'''
+        return (await self.sendRequest('GET', self.encodeURL(endpoint, parameters))).body
+
+    async def downloadRaw(self, endpoint, parameters=None, filename=None, fileobj=None, resume=False):
+        '''
+        save the RAW page data of an endpoint to `filename` or the binary file object `fileobj`, see Toggl.downloadRaw,
+        the asyncio transport does not stream so the body is held in memory
+        :return: number of bytes written
+        '''
+        offset, headers = self.downloadHeaders(filename, resume=resume)
+        if offset:
+            headers['Accept-Encoding'] = 'identity'  # the range is one of the file, not of a compressed transfer
+        try:
+            response = await self.sendRequest('GET', self.encodeURL(endpoint, parameters), headers=headers)
+        except HTTPError as e:
+            if e.code == 416 and offset:  # Range Not Satisfiable, the file is already complete
+                return 0
+            raise
+        if offset and response.status != 206:
+            offset = 0  # the whole body came again
+        if fileobj is not None:
+            fileobj.write(response.body)
+        else:
+            with open(filename, 'ab' if offset else 'wb') as target:
+                target.write(response.body)
+        return len(response.body)
+
+    async def request(self, endpoint, parameters=None):
+        '''make a request to the toggle api at a certain endpoint and return the page data as a parsed JSON dict'''
+        return codec.loads(await self.requestRaw(endpoint, parameters))
+
+    async def postRequest(self, endpoint, parameters=None, method='POST'):
+        '''make a POST request to the toggle api at a certain endpoint and return the RAW page data (usually JSON)'''
+        if method == 'DELETE':
+            return (await self.sendRequest(method, endpoint)).code
+        body = None if parameters is None else codec.dumps(parameters)
+        return (await self.sendRequest(method, endpoint, body=body)).body.decode('utf-8')
+
+    async def close(self):
+        await self.transport.close()
+
+    # ---------------------------------
+    # Methods for managing Time Entries
+    # ---------------------------------
+
+    async def startTimeEntry(self, description, pid=None, tid=None):
+        '''starts a new Time Entry'''
+        data = self.startTimeEntryData(description, pid, tid)
+        return self.decodeJSON(await self.postRequest(Endpoints.START_TIME, parameters=data))
+
+    async def currentRunningTimeEntry(self):
+        '''Gets the Current Time Entry'''
+        return await self.postRequest(Endpoints.CURRENT_RUNNING_TIME, method="GET")
+
+    async def stopTimeEntry(self, entryid):
+        '''Stop the time entry'''
+        return await self.postRequest(Endpoints.STOP_TIME(entryid), method="PUT")
+
+    async def createTimeEntry(self, hourduration, description=None, projectid=None, projectname=None,
+                              taskid=None, clientname=None, year=None, month=None, day=None, hour=None,
+                              billable=False, hourdiff=-2):
+        '''create a custom time entry, see Toggl.createTimeEntry for the parameters'''
+        if not projectid:
+            if projectname and clientname:
+                projectid = (await self.getClientProject(clientname, projectname))['data']['id']
+            elif projectname:
+                projectid = (await self.searchClientProject(projectname))['data']['id']
+            else:
+                raise ValueError("createTimeEntry needs a projectid or a projectname")
+
+        data = self.timeEntryData(hourduration, projectid, description=description, taskid=taskid, year=year,
+                                  month=month, day=day, hour=hour, billable=billable, hourdiff=hourdiff)
+        return self.decodeJSON(await self.postRequest(Endpoints.TIME_ENTRIES, parameters=data))
+
+    async def createTimeEntries(self, entries, workers=4, retries=3, backoff=1.0, checkpoint=None, key=None,
+                                progress=None, prepare=None):
+        '''
+        create many time entries concurrently, `workers` at a time, see Toggl.createTimeEntries for the parameters
+        :return: list of toggl.bulk.BulkResult, in the order of `entries`
+        '''
+        async def create(entry):
+            return await self.createTimeEntry(**(prepare(entry) if prepare is not None else entry))
+
+        return await run_bulk_async(create, entries, workers=workers, retries=retries, backoff=backoff,
+                                    checkpoint=checkpoint, key=key, progress=progress, retry=is_unsent)
+
+    async def putTimeEntry(self, parameters):
+        endpoint = self.putTimeEntryEndpoint(parameters)
+        return self.decodeJSON(await self.postRequest(endpoint, parameters={'time_entry': parameters}, method='PUT'))
+
+    async def deleteTimeEntry(self, entryid):
+        '''Delete the time entry'''
+        return await self.postRequest(Endpoints.TIME_ENTRIES + "/" + str(entryid), method='DELETE')
+
+    # ----------------------------------
+    # Methods for getting workspace data
+    # ----------------------------------
+
+    async def getMe(self, withRelatedData=False, since=None):
+        '''return the current user, see Toggl.getMe for the parameters'''
+        return await self.request(Endpoints.ME, parameters=self.meParameters(withRelatedData, since))
+
+    async def getWorkspaces(self):
+        '''return all the workspaces for a user'''
+        return await self.request(Endpoints.WORKSPACES)
+
+    async def getWorkspace(self, name=None, id=None):
+        '''return the first workspace that matches a given name or id'''
+        if name is None and id is None:
+            print("Error in getWorkspace(), please enter either a name or an id as a filter")
+            return None
+        for workspace in await self.getWorkspaces():
+            if (id is None and workspace['name'] == name) or (id is not None and workspace['id'] == int(id)):
+                return workspace
+        return None
+
+    async def getWorkspaceProjects(self, id):
+        '''return all of the projects for a given Workspace'''
+        return await self.request(Endpoints.WORKSPACES + '/{0}'.format(id) + '/projects')
+
+    # -------------------------------
+    # Methods for getting client data
+    # -------------------------------
+
+    async def getClients(self):
+        '''return all clients that are visable to a user'''
+        return await self.request(Endpoints.CLIENTS)
+
+    async def getClient(self, name=None, id=None):
+        '''return the first client that matches a given name or id'''
+        if name is None and id is None:
+            print("Error in getClient(), please enter either a name or an id as a filter")
+            return None
+        for client in await self.getClients():
+            if (id is None and client['name'] == name) or (id is not None and client['id'] == int(id)):
+                return client
+        return None
+
+    async def getClientProjects(self, id, active='true'):
+        '''return the projects of a client, active may be true/false/both'''
+        return await self.request(Endpoints.CLIENTS + '/{0}/projects?active={1}'.format(id, active))
+
+    async def searchClientProject(self, name):
+        '''find a project by name among the projects of every client, fetching them concurrently'''
+        clients = await self.getClients()
+        results = await asyncio.gather(*(self.getClientProjects(client['id']) for client in clients),
+                                       return_exceptions=True)
+        for projects in results:
+            if isinstance(projects, Exception) or not projects:
+                continue
+            for project in projects:
+                if project['name'] == name:
+                    return project
+
+        print('Could not find client by the name')
+        return None
+
+    async def getClientProject(self, clientName, projectName):
+        '''return the project given the Client's name and Project's name'''
+        client = await self.getClient(name=clientName)
+        if client is None:
+            print('Could not find such client name')
+            return None
+
+        for project in await self.getClientProjects(client['id']) or []:
+            if project['name'] == projectName:
+                return await self.getProject(project['id'])
+
+        print('Could not find such project name')
+        return None
+
+    # --------------------------------
+    # Methods for getting PROJECTS data
+    # --------------------------------
+
+    async def getProject(self, pid):
+        '''return a project'''
+        return await self.request(Endpoints.PROJECTS + '/{0}'.format(pid))
+
+    async def getProjectTasks(self, pid, archived=False):
+        '''return all tasks of a given project'''
+        return await self.request(Endpoints.PROJECTS + '/{0}'.format(pid) + '/tasks')
+
+    # --------------------------------
+    # Methods for interacting with TASKS data
+    # --------------------------------
+
+    async def createTask(self, name, pid, active=True, estimatedSeconds=False):
+        '''create a new task (Requirement: Toggl Starter or higher)'''
+        data = {'task': {'name': name, 'pid': pid, 'active': active, 'estimated_seconds': estimatedSeconds}}
+        return self.decodeJSON(await self.postRequest(Endpoints.TASKS, parameters=data))
+
+    # --------------------------------
+    # Methods for getting reports data
+    # ---------------------------------
+
+    async def getWeeklyReport(self, data):
+        '''return a weekly report for a user'''
+        return await self.request(Endpoints.REPORT_WEEKLY, parameters=data)
+
+    async def getWeeklyReportPDF(self, data, filename, resume=False):
+        '''save a weekly report as a PDF'''
+        await self.downloadRaw(Endpoints.REPORT_WEEKLY + ".pdf", parameters=data, filename=filename, resume=resume)
+
+    async def getDetailedReport(self, data):
+        '''return a detailed report for a user'''
+        return await self.request(Endpoints.REPORT_DETAILED, parameters=data)
+
+    async def getDetailedReportPages(self, data):
+        '''return detailed report data from all pages for a user, the remaining pages are fetched concurrently'''
+        pages = await self.request(Endpoints.REPORT_DETAILED, parameters=dict(data, page=1))
+        rest = await asyncio.gather(*(
+            self.request(Endpoints.REPORT_DETAILED, parameters=dict(data, page=page))
+            for page in range(2, self.countPages(pages) + 1)
+        ))
+        for page in rest:
+            pages['data'].extend(page.get('data', []))
+        return pages
+
+    async def getDetailedReportPDF(self, data, filename, resume=False):
+        '''save a detailed report as a pdf'''
+        await self.downloadRaw(Endpoints.REPORT_DETAILED + ".pdf", parameters=data, filename=filename, resume=resume)
+
+    async def getDetailedReportCSV(self, data, filename=None):
+        '''save a detailed report as a csv'''
+        filedata = await self.requestRaw(Endpoints.REPORT_DETAILED + ".csv", parameters=data)
+        if filename:
+            with open(filename, "wb") as csv:
+                csv.write(filedata)
+        else:
+            return filedata
+
+    async def getSummaryReport(self, data):
+        '''return a summary report for a user'''
+        return await self.request(Endpoints.REPORT_SUMMARY, parameters=data)
+
+    async def getSummaryReportPDF(self, data, filename, resume=False):
+        '''save a summary report as a pdf'''
+        await self.downloadRaw(Endpoints.REPORT_SUMMARY + ".pdf", parameters=data, filename=filename, resume=resume)
+
+    # --------------------------------
+    # Methods for creating, updating, and deleting clients
+    # ---------------------------------
+
+    async def createClient(self, name, wid, notes=None):
+        '''create a new client'''
+        data = {'client': {'name': name, 'wid': wid, 'notes': notes}}
+        return self.decodeJSON(await self.postRequest(Endpoints.CLIENTS, parameters=data))
+
+    async def updateClient(self, id, name=None, notes=None):
+        '''update data for an existing client'''
+        data = {'client': {'name': name, 'notes': notes}}
+        return self.decodeJSON(
+            await self.postRequest(Endpoints.CLIENTS + '/{0}'.format(id), parameters=data, method='PUT')
+        )
+
+    async def deleteClient(self, id):
+        '''delete the specified client'''
+        return await self.postRequest(Endpoints.CLIENTS + '/{0}'.format(id), method='DELETE')
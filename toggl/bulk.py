@@ -0,0 +1,336 @@
+"""
+Bulk operations for TogglPy.
+
+run_bulk() applies a function (e.g. Toggl.createTimeEntry) to many items on
+a pool of worker threads, retries transient failures with exponential
+backoff, reports a result per item and can record finished items in a
+checkpoint file so that an interrupted run resumes where it stopped. What
+counts as transient is up to the caller: a create that timed out may well
+have been committed, so Toggl.createTimeEntries only retries requests that
+never reached the server.
+run_grouped() does the same for endpoints accepting many items per request,
+first_result() returns the answer of the first item giving one, and
+run_bulk_async() is run_bulk() for coroutine functions (toggl.aio).
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.error import HTTPError, URLError
+
+from toggl.transport import ConnectionFailed
+
+
+class BulkResult():
+    '''outcome of one item of a bulk operation'''
+
+    def __init__(self, index, key, item, response=None, error=None, attempts=0, skipped=False):
+        self.index = index
+        self.key = key
+        self.item = item
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+        self.skipped = skipped  # already done according to the checkpoint
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        state = 'skipped' if self.skipped else 'ok' if self.ok else 'error: %r' % (self.error,)
+        return '<BulkResult %s %s>' % (self.key, state)
+
+
+def as_key(value):
+    '''turn the JSON lists a tuple key was written as back into tuples'''
+    if isinstance(value, list):
+        return tuple(as_key(part) for part in value)
+    return value
+
+
+class Checkpoint():
+    '''
+    Append-only JSON lines file recording the keys of finished items and their responses.
+    Keys are JSON scalars or tuples of them.
+    :param path: file to read previous progress from and append new progress to
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short when the previous run was killed
+                    self.done[as_key(record['key'])] = record.get('response')
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def record(self, key, response):
+        with self._lock:
+            self.done[key] = response
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'response': response}) + '\n')
+
+
+def is_transient(error):
+    '''whether an error is worth retrying: rate limiting, server errors and network failures'''
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (URLError, ConnectionError, socket.timeout))
+
+
+def is_transient_request(error):
+    '''
+    is_transient() for functions calling Toggl.sendRequest, which already retries 429 Too Many Requests
+    itself, so that retries don't multiply
+    '''
+    if isinstance(error, HTTPError) and error.code == 429:
+        return False
+    return is_transient(error)
+
+
+def is_unsent(error):
+    '''whether a request failed before it was sent, the only safe retry of a request that isn't idempotent'''
+    return isinstance(error, ConnectionFailed)
+
+
+def run_bulk(func, items, workers=4, retries=3, backoff=1.0, checkpoint=None, key=None, progress=None,
+             retry=is_transient):
+    '''
+    Call func(item) for every item concurrently and return a list of BulkResult in input order.
+    :param func: callable taking one item
+    :param items: iterable of items, consumed lazily
+    :param workers: number of worker threads
+    :param retries: how many times an item failing with a transient error is retried
+    :param backoff: seconds to wait before the first retry, doubled for every following one
+    :param checkpoint: path of a checkpoint file, items recorded there are skipped
+    :param key: callable returning a key for an item (JSON scalar or tuple of them), defaults to its position
+    :param progress: callable receiving (number of finished items, BulkResult) after each item
+    :param retry: callable telling whether an error is worth retrying, see is_transient()
+    Errors of func are recorded in the results, but KeyboardInterrupt and SystemExit stop the run and are raised,
+    as are errors raised by progress or while writing the checkpoint.
+    '''
+    checkpoint = Checkpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+    results = []
+    finished = [0]
+    lock = threading.Lock()
+
+    def report(result):
+        with lock:
+            finished[0] += 1
+            done = finished[0]
+        if progress is not None:
+            progress(done, result)
+
+    def attempt(result):
+        while True:
+            result.attempts += 1
+            try:
+                result.response = func(result.item)
+                result.error = None
+            except Exception as e:
+                result.error = e
+                if result.attempts <= retries and retry(e):
+                    time.sleep(backoff * 2 ** (result.attempts - 1) * (0.5 + random.random()))
+                    continue
+            except BaseException as e:
+                result.error = e
+                raise
+            break
+        if result.ok and checkpoint is not None:
+            checkpoint.record(result.key, result.response)
+        report(result)
+        return result
+
+    def collect(futures):
+        '''raise what escaped attempt(), it must not go unnoticed in the executor'''
+        for future in futures:
+            future.result()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        try:
+            for index, item in enumerate(items):
+                item_key = key(item) if key is not None else index
+                if checkpoint is not None and item_key in checkpoint:
+                    result = BulkResult(index, item_key, item, response=checkpoint.done[item_key], skipped=True)
+                    results.append(result)
+                    report(result)
+                    continue
+                result = BulkResult(index, item_key, item)
+                results.append(result)
+                pending.add(executor.submit(attempt, result))
+                if len(pending) >= workers * 2:  # don't read the whole iterable ahead of the workers
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(pending)[0])
+        except BaseException:
+            for future in pending:
+                future.cancel()  # the items not started yet
+            raise
+    return results
+
+
+async def run_bulk_async(func, items, workers=4, retries=3, backoff=1.0, checkpoint=None, key=None, progress=None,
+                         retry=is_transient):
+    '''
+    Coroutine counterpart of run_bulk(): await func(item) for every item, up to `workers` at a time,
+    and return a list of BulkResult in input order. The parameters are those of run_bulk().
+    '''
+    checkpoint = Checkpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+    results = []
+    finished = 0
+    semaphore = asyncio.Semaphore(workers)
+
+    def report(result):
+        nonlocal finished
+        finished += 1
+        if progress is not None:
+            progress(finished, result)
+
+    async def attempt(result):
+        async with semaphore:
+            while True:
+                result.attempts += 1
+                try:
+                    result.response = await func(result.item)
+                    result.error = None
+                except Exception as e:
+                    result.error = e
+                    if result.attempts <= retries and retry(e):
+                        await asyncio.sleep(backoff * 2 ** (result.attempts - 1) * (0.5 + random.random()))
+                        continue
+                except BaseException as e:
+                    result.error = e
+                    raise
+                break
+        if result.ok and checkpoint is not None:
+            checkpoint.record(result.key, result.response)
+        report(result)
+
+    pending = []
+    for index, item in enumerate(items):
+        item_key = key(item) if key is not None else index
+        if checkpoint is not None and item_key in checkpoint:
+            result = BulkResult(index, item_key, item, response=checkpoint.done[item_key], skipped=True)
+            results.append(result)
+            report(result)
+            continue
+        result = BulkResult(index, item_key, item)
+        results.append(result)
+        pending.append(asyncio.ensure_future(attempt(result)))
+    try:
+        await asyncio.gather(*pending)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        raise
+    return results
+
+
+def run_grouped(func, items, size, workers=4, retries=3, backoff=1.0, progress=None, retry=is_transient):
+    '''
+    Call func(group) for groups of up to `size` items concurrently and return one BulkResult per item in input order.
+    :param func: callable taking a list of items and returning a dict of item -> response for the items it handled,
+                 items missing from the dict fail with a LookupError
+    :param size: maximum number of items per group
+    :param progress: callable receiving (number of finished items, BulkResult) after each item
+    Other parameters are those of run_bulk(), retries apply to whole groups.
+    '''
+    items = list(items)
+    groups = [items[start:start + size] for start in range(0, len(items), size)]
+    results = [None] * len(items)
+    finished = [0]
+    lock = threading.Lock()
+
+    def group_done(done, group_result):
+        '''expand a finished group into the results of its items, reporting them right away'''
+        for offset, item in enumerate(group_result.item):
+            index = group_result.index * size + offset
+            result = BulkResult(index, item, item, attempts=group_result.attempts)
+            if not group_result.ok:
+                result.error = group_result.error
+            elif item in group_result.response:
+                result.response = group_result.response[item]
+            else:
+                result.error = LookupError('%r is missing from the response' % (item,))
+            results[index] = result
+            if progress is not None:
+                with lock:
+                    finished[0] += 1
+                    count = finished[0]
+                progress(count, result)
+
+    run_bulk(func, groups, workers=workers, retries=retries, backoff=backoff, progress=group_done, retry=retry)
+    return results
+
+
+def first_result(func, items, workers=4, ignore=is_transient):
+    '''
+    Return func(item) for the first item, in input order, whose result is not None, or None when there is none,
+    so that the answer does not depend on `workers`. Up to `workers` items are looked up at a time on threads,
+    earlier items still running are waited for, and no item after a found result is started. The calls already
+    running are waited for, so nothing keeps using the rate limit after this returns.
+    :param ignore: callable telling which errors count as no result (transient ones by default), the last of them is
+                   raised when no item gives a result, any other error is raised when the scan reaches its item
+    '''
+    error = None
+    if workers <= 1:
+        for item in items:
+            try:
+                result = func(item)
+            except Exception as e:
+                if not ignore(e):
+                    raise
+                error = e
+                continue
+            if result is not None:
+                return result
+        if error is not None:
+            raise error
+        return None
+
+    found = [None]  # index of the earliest item known to have a result
+    lock = threading.Lock()
+
+    def call(index, item):
+        if found[0] is not None and found[0] < index:
+            return None  # an earlier item already has the answer
+        result = func(item)
+        if result is not None:
+            with lock:
+                if found[0] is None or index < found[0]:
+                    found[0] = index
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(call, index, item) for index, item in enumerate(items)]
+    try:
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                if not ignore(e):
+                    raise
+                error = e
+                continue
+            if result is not None:
+                return result
+        if error is not None:
+            raise error
+        return None
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,74 @@
+"""
+In-memory cache for Toggl metadata (workspaces, clients, projects, tasks).
+
+Entries expire after a per-resource time to live, the cache is bounded in
+size with least recently used eviction, and whole resources are invalidated
+when Toggl methods modify them.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# seconds metadata is kept by default, per resource
+DEFAULT_TTLS = {
+    'workspaces': 3600,
+    'clients': 300,
+    'projects': 300,
+    'tasks': 300,
+}
+
+MISSING = object()
+
+
+class MetadataCache():
+    '''
+    Thread safe LRU cache with per-resource expiry.
+    Cached responses are shared between callers and must not be modified.
+    :param ttls: dict of resource name -> seconds to live, merged over DEFAULT_TTLS
+    :param maxsize: maximum number of cached responses
+    '''
+
+    def __init__(self, ttls=None, maxsize=256):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (resource, key) -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, resource, key):
+        '''return the cached value or MISSING'''
+        with self._lock:
+            entry = self._entries.get((resource, key))
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end((resource, key))
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[(resource, key)]
+            self.misses += 1
+            return MISSING
+
+    def set(self, resource, key, value):
+        ttl = self.ttls.get(resource, 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(resource, key)] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end((resource, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *resources):
+        '''drop every cached value of the given resources, or everything when none is given'''
+        with self._lock:
+            if not resources:
+                self._entries.clear()
+                return
+            for cached in [cached for cached in self._entries if cached[0] in resources]:
+                del self._entries[cached]
+
+    def stats(self):
+        '''return hit/miss counters and the current size'''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
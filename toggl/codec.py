@@ -0,0 +1,73 @@
+"""
+JSON serialization used by every TogglPy request.
+
+The encoder and decoder are created once and reused. Bodies are decoded
+straight from the bytes received, and when orjson or ujson is installed it
+is used instead of the standard library. The TOGGLPY_JSON environment
+variable ('orjson', 'ujson' or 'json') or set_backend() force a backend.
+"""
+import json
+import os
+
+_json_decoder = json.JSONDecoder()
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def _json_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return _json_decoder.decode(data)
+
+
+def _json_dumps(obj):
+    return _json_encoder.encode(obj).encode('utf-8')
+
+
+def load_backend(name):
+    '''return (loads, dumps) of a backend, raising ImportError when it is not installed'''
+    if name == 'orjson':
+        import orjson
+        return orjson.loads, orjson.dumps
+    if name == 'ujson':
+        import ujson
+
+        def dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+        return ujson.loads, dumps
+    if name == 'json':
+        return _json_loads, _json_dumps
+    raise ValueError("unknown JSON backend %r" % (name,))
+
+
+BACKENDS = ('orjson', 'ujson', 'json')
+backend = None
+loads = dumps = None
+
+
+def set_backend(name=None):
+    '''select the JSON backend by name, or the fastest installed one when name is None'''
+    global backend, loads, dumps
+    for candidate in ([name] if name else BACKENDS):
+        try:
+            loads, dumps = load_backend(candidate)
+        except ImportError:
+            if name:
+                raise
+            continue
+        backend = candidate
+        return backend
+
+
+def available_backends():
+    '''names of the backends that can be imported'''
+    names = []
+    for name in BACKENDS:
+        try:
+            load_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+set_backend(os.environ.get('TOGGLPY_JSON') or None)
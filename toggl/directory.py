@@ -0,0 +1,115 @@
+"""
+In-memory directory of Toggl workspaces, clients and projects.
+
+The directory downloads everything once, in bulk, and indexes it by id,
+by name and by (client name, project name) so that lookups which Toggl
+otherwise answers with a linear scan over freshly downloaded lists (or,
+for searchClientProject, one request per client) take constant time.
+"""
+import threading
+import time
+
+
+class TogglDirectory():
+    '''
+    Indexes of the workspaces, clients and projects visible to a Toggl object.
+    :param toggl: the Toggl object used to load the data
+    '''
+
+    def __init__(self, toggl):
+        self.toggl = toggl
+        self.loaded_at = None  # epoch of the last load or refresh
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.workspaces = {}  # id -> workspace
+        self.clients = {}  # id -> client
+        self.projects = {}  # id -> project
+        self._workspaces_by_name = {}
+        self._clients_by_name = {}
+        self._projects_by_name = {}
+        self._projects_by_client = {}  # (client name, project name) -> project
+
+    def _reindex(self):
+        '''rebuild the name indexes from the id indexes, the first item seen for a name wins'''
+        self._workspaces_by_name = {}
+        self._clients_by_name = {}
+        self._projects_by_name = {}
+        self._projects_by_client = {}
+        for workspace in self.workspaces.values():
+            self._workspaces_by_name.setdefault(workspace.get('name'), workspace)
+        for client in self.clients.values():
+            self._clients_by_name.setdefault(client.get('name'), client)
+        for project in self.projects.values():
+            self._projects_by_name.setdefault(project.get('name'), project)
+            client = self.clients.get(project.get('cid'))
+            if client is not None:
+                self._projects_by_client.setdefault((client.get('name'), project.get('name')), project)
+
+    def load(self):
+        '''download workspaces, clients and the projects of every workspace and index them'''
+        started = int(time.time())
+        workspaces = self.toggl.getWorkspaces() or []
+        clients = self.toggl.getClients() or []
+        projects = []
+        for workspace in workspaces:
+            projects.extend(self.toggl.getWorkspaceProjects(workspace['id']) or [])
+
+        with self._lock:
+            self._reset()
+            self.workspaces = {workspace['id']: workspace for workspace in workspaces}
+            self.clients = {client['id']: client for client in clients}
+            self.projects = {project['id']: project for project in projects}
+            self._reindex()
+            self.loaded_at = started
+        return self
+
+    def refresh(self):
+        '''
+        apply the workspaces, clients and projects changed since the last load or refresh,
+        using a single call to the /me endpoint with related data
+        '''
+        if self.loaded_at is None:
+            return self.load()
+        started = int(time.time())
+        changes = self.toggl.getMe(withRelatedData=True, since=self.loaded_at).get('data', {})
+        with self._lock:
+            for key, index in (('workspaces', self.workspaces), ('clients', self.clients),
+                               ('projects', self.projects)):
+                for item in changes.get(key) or []:
+                    if item.get('server_deleted_at') or item.get('active') is False:
+                        index.pop(item['id'], None)
+                    else:
+                        index[item['id']] = item
+            self._reindex()
+            self.loaded_at = started
+        return self
+
+    # ---------------------------------------------------
+    # Lookups, all of them answered without any API call
+    # ---------------------------------------------------
+
+    def workspace(self, name=None, id=None):
+        '''return the workspace with the given id or name, or None'''
+        if id is not None:
+            return self.workspaces.get(int(id))
+        return self._workspaces_by_name.get(name)
+
+    def client(self, name=None, id=None):
+        '''return the client with the given id or name, or None'''
+        if id is not None:
+            return self.clients.get(int(id))
+        return self._clients_by_name.get(name)
+
+    def project(self, name=None, id=None, clientName=None):
+        '''return the project with the given id, name or client name and project name, or None'''
+        if id is not None:
+            return self.projects.get(int(id))
+        if clientName is not None:
+            return self._projects_by_client.get((clientName, name))
+        return self._projects_by_name.get(name)
+
+    def clientProjects(self, id):
+        '''return the projects of a client'''
+        return [project for project in self.projects.values() if project.get('cid') == int(id)]
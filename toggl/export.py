@@ -0,0 +1,226 @@
+"""
+Incremental export of detailed reports to NDJSON, Parquet and Arrow files.
+
+getDetailedReportCSV buffers the whole server-rendered CSV, and
+getDetailedReportPages the whole report as dicts. The writers here take the
+entries one page at a time (from Toggl.iterDetailedReport) and write them in
+row groups of `row_group_size` rows with a fixed schema, so memory use
+depends on the row group size and not on the size of the report. Start and
+end are epoch seconds, durations milliseconds as in the report API. Parquet
+and Arrow files need pyarrow (pip install TogglPy[parquet]), NDJSON only the
+standard library.
+"""
+import os
+from abc import ABC, abstractmethod
+
+from toggl import codec
+from toggl.records import TimeEntry
+
+# (column, type) of every exported row
+SCHEMA = (
+    ('id', 'int64'),
+    ('pid', 'int64'),
+    ('tid', 'int64'),
+    ('uid', 'int64'),
+    ('start', 'int64'),
+    ('end', 'int64'),
+    ('updated', 'int64'),
+    ('dur', 'int64'),
+    ('user', 'string'),
+    ('client', 'string'),
+    ('project', 'string'),
+    ('task', 'string'),
+    ('description', 'string'),
+    ('tags', 'list<string>'),
+    ('billable', 'float64'),
+    ('is_billable', 'bool'),
+)
+COLUMNS = tuple(name for name, _ in SCHEMA)
+# file extension -> format
+FORMATS = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Arrow export need pyarrow, install it with: pip install TogglPy[parquet]")
+    return pyarrow
+
+
+def arrow_schema():
+    pa = import_pyarrow()
+    types = {'int64': pa.int64(), 'float64': pa.float64(), 'bool': pa.bool_(), 'string': pa.string(),
+             'list<string>': pa.list_(pa.string())}
+    return pa.schema([(name, types[kind]) for name, kind in SCHEMA])
+
+
+def entry_row(entry, interned=None):
+    '''the values of a report dict (or TimeEntry) in the order of SCHEMA'''
+    if not isinstance(entry, TimeEntry):
+        entry = TimeEntry.from_dict(entry, interned)
+    row = [getattr(entry, name) for name in COLUMNS]
+    row[COLUMNS.index('tags')] = list(entry.tags or ())
+    row[COLUMNS.index('is_billable')] = bool(entry.is_billable)
+    if entry.billable is not None:
+        row[COLUMNS.index('billable')] = float(entry.billable)  # whole amounts arrive as JSON integers
+    return row
+
+
+def columns(rows):
+    '''transpose rows into one list of values per column of SCHEMA'''
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in SCHEMA]
+
+
+class ReportWriter(ABC):
+    '''
+    Base class of the export writers, collects rows and hands them to write_group() every `row_group_size` rows.
+    :param path: file path, or a binary file object left open on close()
+    :param row_group_size: rows held in memory before they are written
+    '''
+
+    def __init__(self, path, row_group_size=10000):
+        if row_group_size < 1:
+            raise ValueError("row_group_size must be at least 1")
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self.row_groups = 0
+        self._rows = []
+        self._interned = {}
+        self._closed = False
+        if hasattr(path, 'write'):
+            self.file, self._owns_file = path, False
+        else:
+            self.file, self._owns_file = open(os.path.expanduser(path), 'wb'), True
+
+    def write(self, entry):
+        '''add one report dict or TimeEntry'''
+        self._rows.append(entry_row(entry, self._interned))
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.write(entry)
+
+    def flush(self):
+        '''write the rows collected so far as one row group'''
+        if not self._rows:
+            return
+        self.write_group(self._rows)
+        self.rows_written += len(self._rows)
+        self.row_groups += 1
+        self._rows = []
+        self._interned = {}  # only share strings within a row group, so memory stays bounded
+
+    @abstractmethod
+    def write_group(self, rows):
+        '''write one row group, a list of rows with the values in the order of SCHEMA'''
+
+    def finish(self):
+        '''write what the format needs after the last row group'''
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self.finish()
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NDJSONWriter(ReportWriter):
+    '''one JSON object per line, with the keys of SCHEMA'''
+
+    def write_group(self, rows):
+        self.file.write(b''.join(codec.dumps(dict(zip(COLUMNS, row))) + b'\n' for row in rows))
+
+
+class ColumnarWriter(ReportWriter):
+    '''Base class of the column oriented writers, hands every row group to write_columns() as columns'''
+
+    def write_group(self, rows):
+        self.write_columns(columns(rows))
+
+    @abstractmethod
+    def write_columns(self, columns):
+        '''write one row group, a list of values per column of SCHEMA'''
+
+
+class ArrowWriter(ColumnarWriter):
+    '''Arrow IPC file (Feather v2), one record batch per row group'''
+
+    def __init__(self, path, row_group_size=10000):
+        self.pyarrow = import_pyarrow()
+        self.schema = arrow_schema()
+        self._writer = None
+        super().__init__(path, row_group_size)
+
+    def open_writer(self):
+        return self.pyarrow.ipc.new_file(self.file, self.schema)
+
+    def table(self, columns):
+        arrays = [self.pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        return self.pyarrow.Table.from_arrays(arrays, schema=self.schema)
+
+    def write_columns(self, columns):
+        if self._writer is None:
+            self._writer = self.open_writer()
+        self._writer.write_table(self.table(columns))
+
+    def finish(self):
+        if self._writer is None:
+            self._writer = self.open_writer()  # an empty report still gets a valid file with the schema
+        self._writer.close()
+
+
+class ParquetWriter(ArrowWriter):
+    '''Parquet file, one row group per `row_group_size` rows'''
+
+    def __init__(self, path, row_group_size=10000, compression='zstd'):
+        self.compression = compression
+        super().__init__(path, row_group_size)
+
+    def open_writer(self):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.file, self.schema, compression=self.compression)
+
+
+WRITERS = {'ndjson': NDJSONWriter, 'arrow': ArrowWriter, 'parquet': ParquetWriter}
+
+
+def open_writer(path, format=None, row_group_size=10000):
+    '''
+    return the writer for a format ('ndjson', 'parquet' or 'arrow'), guessed from the extension of path when None
+    '''
+    if format is None:
+        name = path if isinstance(path, str) else getattr(path, 'name', '')
+        format = FORMATS.get(os.path.splitext(str(name))[1].lower())
+        if format is None:
+            raise ValueError("can't tell the export format of %r, pass format=" % (path,))
+    if format not in WRITERS:
+        raise ValueError("format must be one of %s, not %r" % (', '.join(sorted(WRITERS)), format))
+    return WRITERS[format](path, row_group_size=row_group_size)
+
+
+def write_report(toggl, data, path, format=None, row_group_size=10000, prefetch=True):
+    '''
+    Stream a detailed report into an NDJSON, Parquet or Arrow file
+    :param toggl: Toggl object
+    :param data: detailed report parameters
+    :param path: file path or binary file object
+    :param format: 'ndjson', 'parquet' or 'arrow', guessed from the file extension when None
+    :param prefetch: fetch the next report page while the current one is written
+    :return: the writer, with rows_written and row_groups counters
+    '''
+    with open_writer(path, format, row_group_size) as writer:
+        writer.extend(toggl.iterDetailedReport(data, prefetch=prefetch))
+    return writer
@@ -0,0 +1,194 @@
+"""
+Many Toggl accounts in one process.
+
+TogglManager holds one Toggl session per API token (or email/password), each
+with its own Authorization header and its own rate limit budget, all sharing
+one pool of keep-alive connections. Jobs submitted for a session go to that
+session's queue. A fixed set of worker threads takes jobs from the queues in
+round robin order, skipping sessions whose budget is spent until it refills,
+so a busy or throttled account never delays the others.
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from toggl.bulk import BulkResult
+from toggl.TogglPy import Toggl
+from toggl.transport import HTTPTransport
+
+
+class Session():
+    '''a Toggl object and the queue of jobs waiting to use it'''
+
+    def __init__(self, name, toggl, max_in_flight):
+        self.name = name
+        self.toggl = toggl
+        self.max_in_flight = max_in_flight
+        self.queue = deque()  # (future, func, args, kwargs)
+        self.in_flight = 0
+        self.done = 0
+
+    def ready_in(self):
+        '''seconds until this session may start its next job'''
+        if not self.queue or self.in_flight >= self.max_in_flight:
+            return None
+        limiter = self.toggl.rate_limiter
+        return limiter.delay() if limiter is not None else 0.0
+
+
+class TogglManager():
+    '''
+    Isolated Toggl sessions per account, scheduled fairly on a shared pool of worker threads.
+    :param transport: HTTPTransport shared by every session, a new one by default
+    :param workers: number of jobs running at the same time, across all sessions
+    :param rate: requests per second allowed per session, None disables the limit
+    :param burst: requests a session may send back to back
+    :param max_in_flight: jobs of a single session running at the same time
+    '''
+
+    def __init__(self, transport=None, workers=8, rate=1.0, burst=3, max_in_flight=2):
+        self.transport = transport if transport is not None else HTTPTransport(pool_size=workers)
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.sessions = {}
+        self._order = deque()  # session names, rotated to serve them in turn
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+    def add(self, name, api_token=None, email=None, password=None, rate=None, burst=None):
+        '''
+        create the session of an account, authenticated with an API token or email and password,
+        `rate` and `burst` override the manager defaults for this account; returns its Toggl object
+        '''
+        toggl = Toggl(transport=self.transport)
+        if api_token is not None:
+            toggl.setAPIKey(api_token)
+        elif email is not None:
+            toggl.setAuthCredentials(email, password)
+        else:
+            raise ValueError("an api_token or email and password are required")
+        toggl.setRateLimit(rate or self.rate, burst or self.burst)
+        with self._condition:
+            if name in self.sessions:
+                raise ValueError("session %r already exists" % (name,))
+            self.sessions[name] = Session(name, toggl, self.max_in_flight)
+            self._order.append(name)
+        return toggl
+
+    def remove(self, name):
+        '''drop a session, jobs still queued for it are cancelled'''
+        with self._condition:
+            session = self.sessions.pop(name)
+            self._order.remove(name)
+            while session.queue:
+                session.queue.popleft()[0].cancel()
+
+    def __getitem__(self, name):
+        return self.sessions[name].toggl
+
+    def __contains__(self, name):
+        return name in self.sessions
+
+    def names(self):
+        '''session names, in the order they were added'''
+        return list(self.sessions)
+
+    def submit(self, name, func, *args, **kwargs):
+        '''queue func(toggl, *args, **kwargs) for the session `name`, returns a concurrent.futures.Future'''
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("the manager is closed")
+            self.sessions[name].queue.append((future, func, args, kwargs))
+            self._start_workers()
+            self._condition.notify()
+        return future
+
+    def map(self, func, names=None, *args, **kwargs):
+        '''
+        call func(toggl, *args, **kwargs) for every session (or the given names) concurrently
+        :return: list of toggl.bulk.BulkResult in the order of names, keyed by session name
+        '''
+        names = self.names() if names is None else list(names)
+        futures = [self.submit(name, func, *args, **kwargs) for name in names]
+        results = []
+        for index, (name, future) in enumerate(zip(names, futures)):
+            result = BulkResult(index, name, name, attempts=1)
+            try:
+                result.response = future.result()
+            except Exception as e:
+                result.error = e
+            results.append(result)
+        return results
+
+    def stats(self):
+        '''per session number of queued, running and finished jobs and seconds spent waiting for the rate limit'''
+        with self._condition:
+            return {
+                name: {'queued': len(session.queue), 'in_flight': session.in_flight, 'done': session.done,
+                       'waited': session.toggl.rate_limiter.waited if session.toggl.rate_limiter else 0.0}
+                for name, session in self.sessions.items()
+            }
+
+    def close(self, wait=True):
+        '''stop the workers once the queued jobs are done'''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name='toggl-manager-%d' % len(self._threads), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_job(self):
+        '''
+        wait for and return (session, job), taking the first session in turn that may start a job right now,
+        or None once the manager is closed and every queue is empty
+        '''
+        with self._condition:
+            while True:
+                soonest = None
+                for _ in range(len(self._order)):
+                    session = self.sessions[self._order[0]]
+                    self._order.rotate(-1)
+                    ready_in = session.ready_in()
+                    if ready_in is None:
+                        continue
+                    if ready_in <= 0:
+                        session.in_flight += 1
+                        return session, session.queue.popleft()
+                    soonest = ready_in if soonest is None else min(soonest, ready_in)
+                if self._closed and not any(session.queue for session in self.sessions.values()):
+                    return None
+                self._condition.wait(soonest)
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            session, (future, func, args, kwargs) = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(session.toggl, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._condition:
+                session.in_flight -= 1
+                session.done += 1
+                self._condition.notify_all()
@@ -0,0 +1,259 @@
+"""
+Request instrumentation for TogglPy.
+
+Toggl.enableMetrics() attaches a MetricsCollector that records, per endpoint,
+the number of requests by status, a latency histogram, bytes sent and
+received, 429 retries, time spent waiting for the rate limiter, calls
+coalesced with an identical request in flight, calls answered by the report
+cache without a request, GETs answered 304 Not Modified and served from the
+validator cache (recorded with status 304), and metadata cache hits.
+With the priority scheduler enabled it also records, per priority class,
+the time requests spent queued and the queue depth they found.
+Toggl.addRequestHook() registers callbacks that receive a RequestEvent
+before and after every HTTP exchange. When neither is used the request path
+only pays for one attribute check.
+
+Endpoints are labelled with the name of the matching Endpoints constant,
+ids in the rest of the path are replaced by {id}: 'REPORT_DETAILED',
+'CLIENTS/{id}/projects', 'TIME_ENTRIES/{id}/stop'.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# upper bounds of the scheduler wait histogram buckets, in seconds
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_ID = re.compile(r'/\d+(,\d+)*(?=/|$)')  # ids, or comma separated ids of bulk requests
+
+
+class RequestEvent():
+    '''
+    One HTTP exchange, passed to request hooks.
+    status, seconds, bytes_received and error are only set after the exchange.
+    :param attempt: 0 for the first try, then the number of the 429 retry
+    :param waited: seconds spent waiting for the rate limiter before sending
+    '''
+
+    __slots__ = ('method', 'url', 'endpoint', 'attempt', 'waited', 'bytes_sent', 'status', 'seconds',
+                 'bytes_received', 'error')
+
+    def __init__(self, method, url, endpoint, attempt=0, waited=0.0, bytes_sent=0):
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.attempt = attempt
+        self.waited = waited
+        self.bytes_sent = bytes_sent
+        self.status = None
+        self.seconds = None
+        self.bytes_received = 0
+        self.error = None
+
+    def __repr__(self):
+        return '<RequestEvent %s %s %s>' % (self.method, self.endpoint, self.status)
+
+
+def endpoint_names(endpoints):
+    '''return (url prefix, name) pairs of the URL constants of an Endpoints class, longest prefix first'''
+    names = [(value, name) for name, value in vars(endpoints).items()
+             if not name.startswith('_') and isinstance(value, str) and value.startswith('http')]
+    return sorted(names, key=lambda pair: -len(pair[0]))
+
+
+def endpoint_label(url, names):
+    '''label a request URL by its Endpoints constant, see the module docstring'''
+    url = url.split('?', 1)[0]
+    for prefix, name in names:
+        if url.startswith(prefix):
+            return name + _ID.sub('/{id}', url[len(prefix):])
+    return _ID.sub('/{id}', urlsplit(url).path)
+
+
+class Histogram():
+    '''count of observations per bucket (not cumulative), the last bucket counts values above every bound'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {'buckets': dict(zip(bounds, self.counts)), 'sum': self.sum, 'count': self.count}
+
+
+class EndpointMetrics():
+    '''counters of one endpoint'''
+
+    def __init__(self):
+        self.requests = {}  # status (or 'error') -> count
+        self.latency = Histogram()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.rate_limit_waits = 0
+        self.rate_limit_wait_seconds = 0.0
+        self.coalesced = 0  # calls answered by an identical request already in flight
+        self.cache_hits = 0  # calls answered by the report cache, nothing was sent
+        self.revalidated = 0  # requests answered 304 Not Modified, the body came from the validator cache
+
+    def as_dict(self):
+        return {
+            'requests': dict(self.requests), 'latency': self.latency.as_dict(), 'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received, 'retries': self.retries,
+            'rate_limit_waits': self.rate_limit_waits, 'rate_limit_wait_seconds': self.rate_limit_wait_seconds,
+            'coalesced': self.coalesced, 'cache_hits': self.cache_hits, 'revalidated': self.revalidated,
+        }
+
+
+class PriorityMetrics():
+    '''counters of one scheduler priority class'''
+
+    def __init__(self):
+        self.requests = 0
+        self.wait = Histogram(WAIT_BUCKETS)
+        self.queue_depth = 0  # requests of the class still queued when the last one was granted
+        self.max_queue_depth = 0
+
+    def as_dict(self):
+        return {'requests': self.requests, 'wait': self.wait.as_dict(), 'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth}
+
+
+class MetricsCollector():
+    '''Thread safe per-endpoint request metrics, fed by Toggl.sendRequest'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.endpoints = {}
+            self.cache = {}  # resource -> {'hits': n, 'misses': n}
+            self.priorities = {}  # scheduler priority class -> PriorityMetrics
+
+    def _endpoint(self, endpoint):
+        metrics = self.endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self.endpoints[endpoint] = EndpointMetrics()
+        return metrics
+
+    def record(self, event):
+        '''add a finished RequestEvent'''
+        with self._lock:
+            metrics = self._endpoint(event.endpoint)
+            status = event.status if event.status is not None else 'error'
+            metrics.requests[status] = metrics.requests.get(status, 0) + 1
+            metrics.latency.observe(event.seconds)
+            metrics.bytes_sent += event.bytes_sent
+            metrics.bytes_received += event.bytes_received
+            if event.status == 304:
+                metrics.revalidated += 1
+            if event.attempt:
+                metrics.retries += 1
+            if event.waited > 0:
+                metrics.rate_limit_waits += 1
+                metrics.rate_limit_wait_seconds += event.waited
+
+    def record_coalesced(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint).coalesced += 1
+
+    def record_cache_hit(self, endpoint):
+        '''a call answered by the report cache, without any request'''
+        with self._lock:
+            self._endpoint(endpoint).cache_hits += 1
+
+    def record_cache(self, resource, hit):
+        with self._lock:
+            counters = self.cache.setdefault(resource, {'hits': 0, 'misses': 0})
+            counters['hits' if hit else 'misses'] += 1
+
+    def record_scheduled(self, priority, waited, queue_depth):
+        '''a request of a priority class got its token after `waited` seconds, leaving `queue_depth` behind'''
+        with self._lock:
+            metrics = self.priorities.get(priority)
+            if metrics is None:
+                metrics = self.priorities[priority] = PriorityMetrics()
+            metrics.requests += 1
+            metrics.wait.observe(waited)
+            metrics.queue_depth = queue_depth
+            metrics.max_queue_depth = max(metrics.max_queue_depth, queue_depth)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'since': self.started,
+                'endpoints': {name: metrics.as_dict() for name, metrics in self.endpoints.items()},
+                'cache': {resource: dict(counters) for resource, counters in self.cache.items()},
+                'priorities': {name: metrics.as_dict() for name, metrics in self.priorities.items()},
+            }
+
+    def prometheus(self, prefix='togglpy'):
+        '''return the metrics in the Prometheus text exposition format'''
+        snapshot = self.as_dict()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for suffix, labels, value in samples:
+                label_text = ','.join('%s="%s"' % (key, str(label).replace('"', '\\"')) for key, label in labels)
+                lines.append('%s_%s%s{%s} %s' % (prefix, name, suffix, label_text, value))
+
+        endpoints = sorted(snapshot['endpoints'].items())
+        metric('requests_total', 'counter', 'HTTP requests sent to the Toggl API.', [
+            ('', (('endpoint', name), ('status', status)), count)
+            for name, metrics in endpoints for status, count in sorted(metrics['requests'].items(), key=str)
+        ])
+        latency = []
+        for name, metrics in endpoints:
+            cumulative = 0
+            for bound, count in metrics['latency']['buckets'].items():
+                cumulative += count
+                latency.append(('_bucket', (('endpoint', name), ('le', bound)), cumulative))
+            latency.append(('_sum', (('endpoint', name),), metrics['latency']['sum']))
+            latency.append(('_count', (('endpoint', name),), metrics['latency']['count']))
+        metric('request_duration_seconds', 'histogram', 'Duration of HTTP requests to the Toggl API.', latency)
+        for field, help in (('bytes_sent', 'Request body bytes sent.'),
+                            ('bytes_received', 'Response body bytes received.'),
+                            ('retries', 'Requests retried after 429 Too Many Requests.'),
+                            ('rate_limit_waits', 'Requests delayed by the client rate limiter.'),
+                            ('rate_limit_wait_seconds', 'Seconds spent waiting for the client rate limiter.'),
+                            ('coalesced', 'Calls answered by an identical request already in flight.'),
+                            ('cache_hits', 'Calls answered by the report cache without a request.'),
+                            ('revalidated', 'Requests answered 304 Not Modified and served from memory.')):
+            metric(field + '_total', 'counter', help,
+                   [('', (('endpoint', name),), metrics[field]) for name, metrics in endpoints])
+        metric('cache_lookups_total', 'counter', 'Metadata cache lookups.', [
+            ('', (('resource', resource), ('result', {'hits': 'hit', 'misses': 'miss'}[result])), count)
+            for resource, counters in sorted(snapshot['cache'].items()) for result, count in sorted(counters.items())
+        ])
+        if snapshot['priorities']:
+            priorities = sorted(snapshot['priorities'].items())
+            wait = []
+            for name, metrics in priorities:
+                cumulative = 0
+                for bound, count in metrics['wait']['buckets'].items():
+                    cumulative += count
+                    wait.append(('_bucket', (('priority', name), ('le', bound)), cumulative))
+                wait.append(('_sum', (('priority', name),), metrics['wait']['sum']))
+                wait.append(('_count', (('priority', name),), metrics['wait']['count']))
+            metric('scheduler_wait_seconds', 'histogram', 'Seconds requests waited in the priority scheduler.', wait)
+            metric('scheduler_queue_depth', 'gauge', 'Requests of the class queued when the last one was sent.',
+                   [('', (('priority', name),), metrics['queue_depth']) for name, metrics in priorities])
+            metric('scheduler_queue_depth_max', 'gauge', 'Largest queue depth seen per priority class.',
+                   [('', (('priority', name),), metrics['max_queue_depth']) for name, metrics in priorities])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,416 @@
+"""
+Local stand-in for the Toggl API, for offline tests and benchmarks.
+
+MockTogglServer serves generated workspaces, clients, projects, time entries
+and detailed reports (paginated, filterable by date and user, as JSON or CSV)
+on localhost, with optional latency and rate limiting. GET responses carry an
+ETag and larger bodies are gzip compressed when the client accepts it.
+RedirectTransport (AsyncRedirectTransport for AsyncToggl) sends the requests
+meant for api.track.toggl.com to the mock server instead, or with flat=True to
+any local server routing on the bare paths (/workspaces rather than
+/api/v8/workspaces):
+
+    with MockTogglServer(time_entries=5000) as server:
+        toggl = server.client()
+        toggl.getDetailedReportPages({'workspace_id': 1})
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from toggl.aio import AsyncHTTPTransport
+from toggl.ratelimit import TokenBucket
+from toggl.TogglPy import Toggl
+from toggl.transport import HTTPTransport
+
+API_ROOT = 'https://api.track.toggl.com'
+
+
+API_PREFIXES = ('/reports/api/v2', '/api/v8')
+
+
+def redirect_url(url, base_url, flat=False):
+    '''
+    point a Toggl API url at base_url
+    :param flat: also drop the /api/v8 and /reports/api/v2 prefixes, for servers routing on bare paths
+    '''
+    url = url.replace(API_ROOT, base_url, 1)
+    if flat:
+        for prefix in API_PREFIXES:
+            url = url.replace(prefix, '', 1)
+    return url
+
+
+class RedirectTransport(HTTPTransport):
+    '''HTTPTransport sending requests meant for the Toggl API to another base URL'''
+
+    def __init__(self, base_url, flat=False, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+        self.flat = flat
+
+    def request(self, method, url, **kwargs):
+        return super().request(method, redirect_url(url, self.base_url, self.flat), **kwargs)
+
+    def stream(self, method, url, **kwargs):
+        return super().stream(method, redirect_url(url, self.base_url, self.flat), **kwargs)
+
+
+class AsyncRedirectTransport(AsyncHTTPTransport):
+    '''AsyncHTTPTransport sending requests meant for the Toggl API to another base URL'''
+
+    def __init__(self, base_url, flat=False, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+        self.flat = flat
+
+    async def request(self, method, url, **kwargs):
+        return await super().request(method, redirect_url(url, self.base_url, self.flat), **kwargs)
+
+
+class MockData():
+    '''
+    Generated, deterministic Toggl data.
+    :param workspaces: number of workspaces
+    :param clients: number of clients per workspace
+    :param projects: number of projects per client
+    :param users: number of users per workspace
+    :param time_entries: number of time entries per workspace, one hour each, spread over `days` days
+    :param start: date of the first time entry
+    '''
+
+    def __init__(self, workspaces=1, clients=10, projects=5, users=5, time_entries=1000, days=365,
+                 start=datetime(2021, 1, 1, tzinfo=timezone.utc)):
+        self.lock = threading.Lock()
+        self.workspaces = [{'id': w, 'name': 'Workspace %d' % w} for w in range(1, workspaces + 1)]
+        self.clients = []
+        self.projects = []
+        self.clients_by_id = {}
+        self.projects_by_id = {}
+        self.time_entries = {}
+        self.next_id = 10 ** 6
+        self.running = None
+        self._reports = {}  # report query -> entries, cleared by every change
+        for workspace in self.workspaces:
+            wid = workspace['id']
+            for c in range(clients):
+                cid = wid * 1000 + c
+                self.add_client({'id': cid, 'wid': wid, 'name': 'Client %d-%d' % (wid, c)})
+                for p in range(projects):
+                    project = {'id': cid * 100 + p, 'wid': wid, 'cid': cid, 'active': True,
+                               'name': 'Project %d-%d-%d' % (wid, c, p)}
+                    self.projects.append(project)
+                    self.projects_by_id[project['id']] = project
+            workspace_projects = [project for project in self.projects if project['wid'] == wid]
+            for i in range(time_entries):
+                project = workspace_projects[i % len(workspace_projects)]
+                start_time = start + timedelta(days=i * days // max(time_entries, 1), hours=8 + i % 10)
+                self.add_entry(wid, project, 10 + i % users, start_time, 3600, 'Task %d' % (i % 50),
+                               ['tag%d' % (i % 3)])
+
+    def add_entry(self, wid, project, uid, start, duration, description, tags=()):
+        self.next_id += 1
+        entry = {
+            'id': self.next_id, 'wid': wid, 'pid': project['id'] if project else None, 'tid': None, 'uid': uid,
+            'description': description, 'start': start.isoformat(), 'duration': duration,
+            'stop': (start + timedelta(seconds=duration)).isoformat() if duration >= 0 else None,
+            'at': start.isoformat(), 'billable': bool(project and project['id'] % 2), 'tags': list(tags),
+        }
+        self.time_entries[entry['id']] = entry
+        self.changed()
+        return entry
+
+    def report_entry(self, entry):
+        '''a time entry in the shape of the detailed report'''
+        project = self.project(entry['pid'])
+        client = self.client(project['cid']) if project else None
+        return {
+            'id': entry['id'], 'pid': entry['pid'], 'tid': entry['tid'], 'uid': entry['uid'],
+            'description': entry['description'], 'start': entry['start'], 'end': entry['stop'],
+            'updated': entry['at'], 'dur': max(entry['duration'], 0) * 1000, 'user': 'User %d' % entry['uid'],
+            'use_stop': True, 'client': client['name'] if client else None,
+            'project': project['name'] if project else None, 'task': None,
+            'billable': 25.0 if entry['billable'] else None, 'is_billable': entry['billable'],
+            'cur': 'EUR' if entry['billable'] else None, 'tags': entry['tags'],
+        }
+
+    def changed(self):
+        self._reports.clear()
+
+    def add_client(self, client):
+        self.clients.append(client)
+        self.clients_by_id[client['id']] = client
+
+    def project(self, pid):
+        return self.projects_by_id.get(pid)
+
+    def client(self, cid):
+        return self.clients_by_id.get(cid)
+
+    def report(self, workspace_id, since, until, user_ids):
+        '''report entries of a workspace between two dates (inclusive), cached until the data changes'''
+        key = (workspace_id, since, until, user_ids)
+        entries = self._reports.get(key)
+        if entries is None:
+            entries = [
+                entry for entry in self.time_entries.values()
+                if entry['wid'] == workspace_id and since <= entry['start'][:10] <= until
+                and (user_ids is None or entry['uid'] in user_ids)
+            ]
+            entries.sort(key=lambda entry: (entry['start'], entry['id']))
+            entries = self._reports[key] = [self.report_entry(entry) for entry in entries]
+        return entries
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', headers=()):
+        headers = list(headers)
+        if status == 200 and self.command == 'GET':
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+            headers.append(('ETag', etag))
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+        if len(body) >= 1024 and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, 6)
+            headers.append(('Content-Encoding', 'gzip'))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.server.mock.bytes_sent += len(body)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply(self, payload, status=200):
+        self.send_body(status, json.dumps(payload).encode('utf-8'))
+
+    def handle_any(self):
+        server = self.server.mock
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server.record(self.command, url.path, self.client_address)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.limiter is not None and not server.limiter.take():
+            server.throttled += 1
+            return self.send_body(429, b'{"error":"Too Many Requests"}', headers=[('Retry-After', '1')])
+        if not self.headers.get('Authorization'):
+            return self.send_body(403, b'')
+
+        for method, pattern, handler in ROUTES:
+            match = re.match(pattern + '$', url.path)
+            if method == self.command and match:
+                with server.data.lock:
+                    return handler(self, server.data, query, body, *match.groups())
+        self.send_body(404, b'null')
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+    # ---- api v8 ----
+
+    def workspaces(self, data, query, body):
+        self.reply(data.workspaces)
+
+    def workspace_projects(self, data, query, body, wid):
+        self.reply([project for project in data.projects if project['wid'] == int(wid)])
+
+    def clients(self, data, query, body):
+        self.reply(data.clients)
+
+    def client_projects(self, data, query, body, cid):
+        self.reply([project for project in data.projects if project['cid'] == int(cid)] or None)
+
+    def project(self, data, query, body, pid):
+        project = data.project(int(pid))
+        self.reply({'data': project}) if project else self.send_body(404, b'null')
+
+    def me(self, data, query, body):
+        self.reply({'since': int(time.time()), 'data': {'id': 10, 'workspaces': [], 'clients': [], 'projects': []}})
+
+    def create_client(self, data, query, body):
+        client = dict(body['client'], id=max(client['id'] for client in data.clients) + 1)
+        data.add_client(client)
+        self.reply({'data': client})
+
+    def create_time_entry(self, data, query, body):
+        fields = body['time_entry']
+        start = datetime.fromisoformat(fields['start'].replace('.000Z', '+00:00').replace('Z', '+00:00'))
+        wid = data.workspaces[0]['id']
+        entry = data.add_entry(wid, data.project(fields.get('pid')), 10, start, int(fields.get('duration', 0)),
+                               fields.get('description'), fields.get('tags') or ())
+        self.reply({'data': entry})
+
+    def start_time_entry(self, data, query, body):
+        fields = body['time_entry']
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        data.running = data.add_entry(data.workspaces[0]['id'], data.project(fields.get('pid')), 10, now,
+                                      -int(now.timestamp()), fields.get('description'))
+        self.reply({'data': data.running})
+
+    def current_time_entry(self, data, query, body):
+        self.reply({'data': data.running})
+
+    def stop_time_entry(self, data, query, body, id):
+        entry = data.time_entries.get(int(id))
+        if entry is None:
+            return self.send_body(404, b'null')
+        if entry['duration'] < 0:
+            entry['duration'] = int(time.time()) + entry['duration']
+            data.changed()
+        if data.running is not None and data.running['id'] == entry['id']:
+            data.running = None
+        self.reply({'data': entry})
+
+    def update_time_entries(self, data, query, body, ids):
+        updated = []
+        for id in ids.split(','):
+            entry = data.time_entries.get(int(id))
+            if entry is not None:
+                entry.update(body['time_entry'])
+                updated.append(entry)
+        data.changed()
+        if not updated:
+            return self.send_body(404, b'null')
+        self.reply({'data': updated if ',' in ids else updated[0]})
+
+    def delete_time_entry(self, data, query, body, ids):
+        found = [data.time_entries.pop(int(id), None) for id in ids.split(',')]
+        data.changed()
+        self.send_body(200 if any(found) else 404, b'')
+
+    # ---- reports v2 ----
+
+    def report_entries(self, data, query):
+        user_ids = frozenset(int(uid) for uid in query['user_ids'].split(',')) if query.get('user_ids') else None
+        return data.report(int(query.get('workspace_id', 0)), query.get('since', '0000-00-00'),
+                           query.get('until', '9999-99-99'), user_ids)
+
+    def details(self, data, query, body):
+        entries = self.report_entries(data, query)
+        if query.get('order_desc') == 'on':
+            entries = entries[::-1]
+        per_page = self.server.mock.per_page
+        page = int(query.get('page', 1))
+        self.reply({
+            'total_count': len(entries), 'per_page': per_page,
+            'total_grand': sum(entry['dur'] for entry in entries), 'total_billable': None,
+            'total_currencies': [{'currency': None, 'amount': None}],
+            'data': entries[(page - 1) * per_page:page * per_page],
+        })
+
+    def details_csv(self, data, query, body):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['User', 'Client', 'Project', 'Description', 'Start', 'End', 'Duration', 'Tags'])
+        for entry in self.report_entries(data, query):
+            writer.writerow([entry['user'], entry['client'], entry['project'], entry['description'],
+                             entry['start'], entry['end'], entry['dur'] // 1000, ', '.join(entry['tags'])])
+        self.send_body(200, out.getvalue().encode('utf-8'), content_type='text/csv')
+
+    def summary(self, data, query, body):
+        totals = Counter()
+        for entry in self.report_entries(data, query):
+            totals[entry['project']] += entry['dur']
+        self.reply({'total_grand': sum(totals.values()),
+                    'data': [{'title': {'project': project}, 'time': time} for project, time in totals.items()]})
+
+
+ROUTES = [
+    ('GET', r'/api/v8/workspaces', MockHandler.workspaces),
+    ('GET', r'/api/v8/workspaces/(\d+)/projects', MockHandler.workspace_projects),
+    ('GET', r'/api/v8/clients', MockHandler.clients),
+    ('POST', r'/api/v8/clients', MockHandler.create_client),
+    ('GET', r'/api/v8/clients/(\d+)/projects', MockHandler.client_projects),
+    ('GET', r'/api/v8/projects/(\d+)', MockHandler.project),
+    ('GET', r'/api/v8/me', MockHandler.me),
+    ('POST', r'/api/v8/time_entries', MockHandler.create_time_entry),
+    ('POST', r'/api/v8/time_entries/start', MockHandler.start_time_entry),
+    ('GET', r'/api/v8/time_entries/current', MockHandler.current_time_entry),
+    ('PUT', r'/api/v8/time_entries/(\d+)/stop', MockHandler.stop_time_entry),
+    ('PUT', r'/api/v8/time_entries/([\d,]+)', MockHandler.update_time_entries),
+    ('DELETE', r'/api/v8/time_entries/([\d,]+)', MockHandler.delete_time_entry),
+    ('GET', r'/reports/api/v2/details', MockHandler.details),
+    ('GET', r'/reports/api/v2/details\.csv', MockHandler.details_csv),
+    ('GET', r'/reports/api/v2/summary', MockHandler.summary),
+]
+
+
+class MockTogglServer():
+    '''
+    Threaded HTTP server imitating the Toggl API on localhost, use it as a context manager.
+    :param latency: seconds every response is delayed by, to imitate the network
+    :param rate: requests per second served before answering 429 Too Many Requests, None for no limit
+    :param burst: requests that may be sent back to back when rate limited
+    :param per_page: page size of the detailed report
+    :param data_options: keyword arguments of MockData
+    '''
+
+    def __init__(self, latency=0.0, rate=None, burst=1, per_page=50, **data_options):
+        self.data = MockData(**data_options)
+        self.latency = latency
+        self.limiter = TokenBucket(rate, burst) if rate else None
+        self.per_page = per_page
+        self.requests = Counter()  # (method, path) -> count
+        self.connections = set()  # client (host, port) pairs seen
+        self.throttled = 0
+        self.bytes_sent = 0  # response body bytes, after compression
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def record(self, method, path, client_address):
+        with self._lock:
+            self.requests[(method, path)] += 1
+            self.connections.add(client_address)
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._httpd.server_address[:2]
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def transport(self, **kwargs):
+        return RedirectTransport(self.url, **kwargs)
+
+    def client(self, rate=None, **transport_options):
+        '''return a Toggl object talking to this server, without client side rate limit unless `rate` is given'''
+        toggl = Toggl(transport=self.transport(**transport_options))
+        toggl.setAPIKey('mock-api-token')
+        toggl.setRateLimit(rate)
+        return toggl
@@ -0,0 +1,68 @@
+"""
+Date range sharding for large detailed report pulls.
+
+A year long detailed report is one long sequential page walk. ReportPlanner
+splits the since/until range (and optionally the users) into shards, walks
+the shards concurrently so that the rate limiter rather than the latency of
+each page bounds the pull, then removes duplicates and merges the entries in
+start time order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from toggl.sync import MAX_RANGE_DAYS, epoch
+
+
+def as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+class ReportPlanner():
+    '''
+    Plans and runs sharded detailed report pulls.
+    :param toggl: Toggl object used to download the shards
+    :param shard_days: number of days covered by one shard
+    :param split_users: also make one shard per user when `user_ids` is given
+    :param workers: number of shards fetched at the same time
+    '''
+
+    def __init__(self, toggl, shard_days=31, split_users=False, workers=4):
+        if not 1 <= shard_days <= MAX_RANGE_DAYS:
+            raise ValueError("shard_days must be between 1 and %d" % MAX_RANGE_DAYS)
+        self.toggl = toggl
+        self.shard_days = shard_days
+        self.split_users = split_users
+        self.workers = workers
+
+    def plan(self, data):
+        '''return the list of report parameters, one per shard, covering `data`'''
+        if 'since' not in data or 'until' not in data:
+            raise ValueError("since and until are required to shard a report")
+        since, until = as_date(data['since']), as_date(data['until'])
+        users = [None]
+        if self.split_users and data.get('user_ids'):
+            users = [uid.strip() for uid in str(data['user_ids']).split(',') if uid.strip()]
+
+        shards = []
+        for user in users:
+            start = since
+            while start <= until:
+                end = min(until, start + timedelta(days=self.shard_days - 1))
+                shard = dict(data, since=start.isoformat(), until=end.isoformat())
+                if user is not None:
+                    shard['user_ids'] = user
+                shards.append(shard)
+                start = end + timedelta(days=1)
+        return shards
+
+    def fetchShard(self, shard):
+        return list(self.toggl.iterDetailedReport(shard, prefetch=False))
+
+    def fetch(self, data):
+        '''download every shard of `data` concurrently and return the unique entries sorted by start time'''
+        entries = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for shard in executor.map(self.fetchShard, self.plan(data)):
+                for entry in shard:
+                    entries[entry['id']] = entry  # shards may overlap when the same entry spans midnight
+        return sorted(entries.values(), key=lambda entry: (epoch(entry.get('start')) or 0, entry['id']))
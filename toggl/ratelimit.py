@@ -0,0 +1,93 @@
+"""
+Token bucket rate limiting for TogglPy.
+
+Toggl allows roughly one request per second per API token and tolerates
+small bursts, answering 429 with a Retry-After header when a client goes
+over. A single TokenBucket is shared by every thread using a Toggl object.
+"""
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket():
+    '''
+    Thread safe token bucket.
+    :param rate: sustained number of requests allowed per second
+    :param burst: number of requests that may be sent back to back after an idle period
+    '''
+
+    def __init__(self, rate=1.0, burst=1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.rate = float(rate)
+        self.burst = burst
+        self.waited = 0.0  # total seconds callers spent waiting for a token
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self._updated:  # no tokens accrue while penalized
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def reserve(self, tokens=1):
+        '''take tokens from the bucket and return how many seconds the caller has to wait before using them'''
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # tokens may go negative, later callers queue up behind the debt
+            self._tokens -= tokens
+            delay = max(0.0, self._updated - now) + max(0.0, -self._tokens) / self.rate
+            self.waited += delay
+            return delay
+
+    def delay(self, tokens=1):
+        '''seconds until tokens would be available, without taking them'''
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return max(0.0, self._updated - now) + max(0.0, tokens - self._tokens) / self.rate
+
+    def take(self, tokens=1):
+        '''take tokens if they are available right now, returns False instead of waiting'''
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._updated or self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def acquire(self, tokens=1):
+        '''block until tokens are available, returns the number of seconds waited'''
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def penalize(self, seconds):
+        '''stop handing out tokens for the given number of seconds, used when the server answers 429'''
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._updated = max(self._updated, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+
+def retry_after(headers, default=1.0):
+    '''seconds to wait according to a Retry-After header, which may be missing or an HTTP date'''
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,209 @@
+"""
+Compact representations of detailed report time entries.
+
+A detailed report entry decoded by json is a dict of about twenty keys,
+which costs close to two kilobytes per entry. TimeEntry stores the same
+data in __slots__ with timestamps as epoch integers, and TimeEntryBatch
+goes further and stores a whole report column by column: typed arrays of
+integers for ids, times and durations, and dictionary encoded (interned)
+strings for users, projects, clients, tasks, descriptions and tags.
+Keys without a column of their own (project_color, use_stop, ...) are kept
+aside, so both convert back to the dicts Toggl returns.
+"""
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from toggl import codec
+
+# integer columns of TimeEntryBatch
+INT_FIELDS = ('id', 'pid', 'tid', 'uid', 'start', 'end', 'updated', 'dur', 'offset')
+# string columns, stored as codes into a table of distinct values
+STRING_FIELDS = ('description', 'user', 'client', 'project', 'task', 'cur', 'tags')
+# fields copied as is from the report entries, timestamps are handled separately
+PLAIN_FIELDS = ('id', 'pid', 'tid', 'uid', 'dur', 'description', 'user', 'client', 'project', 'task', 'billable',
+                'is_billable', 'cur')
+# every report key with a field of its own, the others go to TimeEntry.extra
+KNOWN_FIELDS = frozenset(PLAIN_FIELDS + ('start', 'end', 'updated', 'tags'))
+MISSING = -1
+
+
+def epoch_and_offset(value):
+    '''return (epoch seconds, utc offset in seconds) of an ISO 8601 timestamp, or (None, None)'''
+    if not value:
+        return None, None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp()), int(parsed.utcoffset().total_seconds())
+
+
+def format_epoch(epoch, offset):
+    '''inverse of epoch_and_offset, rebuild the ISO 8601 timestamp'''
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone(timedelta(seconds=offset or 0))).isoformat()
+
+
+class TimeEntry():
+    '''
+    One detailed report time entry, with start/end/updated as epoch seconds.
+    :param offset: utc offset of the original timestamps, in seconds, used to rebuild them in to_dict()
+    :param extra: dict of the other report keys (project_color, use_stop, ...), None when there are none
+    '''
+
+    __slots__ = ('id', 'pid', 'tid', 'uid', 'start', 'end', 'updated', 'dur', 'offset', 'description', 'user',
+                 'client', 'project', 'task', 'billable', 'is_billable', 'cur', 'tags', 'extra')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, entry, interned=None):
+        '''build a TimeEntry from a report dict, `interned` (a dict) shares equal strings between entries'''
+        entry_fields = {name: entry.get(name) for name in PLAIN_FIELDS}
+        entry_fields['start'], entry_fields['offset'] = epoch_and_offset(entry.get('start'))
+        entry_fields['end'] = epoch_and_offset(entry.get('end'))[0]
+        entry_fields['updated'] = epoch_and_offset(entry.get('updated'))[0]
+        entry_fields['tags'] = tuple(entry.get('tags') or ())
+        extra = {name: value for name, value in entry.items() if name not in KNOWN_FIELDS}
+        if interned is not None:
+            for name in STRING_FIELDS:
+                value = entry_fields[name]
+                if value is not None:
+                    entry_fields[name] = interned.setdefault(value, value)
+            for name, value in extra.items():
+                if isinstance(value, str):
+                    extra[name] = interned.setdefault(value, value)
+        entry_fields['extra'] = extra or None
+        return cls(**entry_fields)
+
+    def to_dict(self):
+        entry = {name: getattr(self, name) for name in PLAIN_FIELDS}
+        entry['start'] = format_epoch(self.start, self.offset)
+        entry['end'] = format_epoch(self.end, self.offset)
+        entry['updated'] = format_epoch(self.updated, self.offset)
+        entry['tags'] = list(self.tags or ())
+        if self.extra:
+            entry.update(self.extra)
+        return entry
+
+    def __eq__(self, other):
+        return isinstance(other, TimeEntry) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        return '<TimeEntry %s %r>' % (self.id, self.description)
+
+
+class TimeEntryBatch():
+    '''
+    Column oriented batch of time entries.
+    Integer columns are array('q') with MISSING for absent values, string columns are array('l') of codes into
+    the `strings` table (MISSING for None), billable amounts are array('d') and is_billable array('b').
+    The extra keys of an entry are stored JSON encoded in the `strings` table too, equal ones only once.
+    '''
+
+    def __init__(self):
+        self.columns = {name: array('q') for name in INT_FIELDS}
+        self.columns.update({name: array('l') for name in STRING_FIELDS})
+        self.columns['billable'] = array('d')
+        self.columns['has_billable'] = array('b')
+        self.columns['is_billable'] = array('b')
+        self.columns['extra'] = array('l')
+        self.strings = []  # distinct string (and tag tuple) values
+        self._codes = {}  # value -> index in strings
+
+    @classmethod
+    def from_entries(cls, entries):
+        batch = cls()
+        batch.extend(entries)
+        return batch
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def code(self, value):
+        '''return the code of a string value, adding it to the table of distinct values'''
+        if value is None:
+            return MISSING
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def append(self, entry):
+        '''add one report dict (or TimeEntry)'''
+        if not isinstance(entry, TimeEntry):
+            entry = TimeEntry.from_dict(entry)
+        columns = self.columns
+        for name in INT_FIELDS:
+            value = getattr(entry, name)
+            columns[name].append(MISSING if value is None else value)
+        for name in STRING_FIELDS:
+            columns[name].append(self.code(getattr(entry, name)))
+        columns['billable'].append(entry.billable or 0.0)
+        columns['has_billable'].append(entry.billable is not None)
+        columns['is_billable'].append(bool(entry.is_billable))
+        columns['extra'].append(self.code(codec.dumps(entry.extra)) if entry.extra else MISSING)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def column(self, name):
+        '''return a column, string columns decoded to a list of values'''
+        if name in STRING_FIELDS:
+            strings = self.strings
+            return [None if code == MISSING else strings[code] for code in self.columns[name]]
+        if name in INT_FIELDS:
+            return [None if value == MISSING else value for value in self.columns[name]]
+        return list(self.columns[name])
+
+    def __getitem__(self, index):
+        columns, strings = self.columns, self.strings
+        fields = {}
+        for name in INT_FIELDS:
+            value = columns[name][index]
+            fields[name] = None if value == MISSING else value
+        for name in STRING_FIELDS:
+            code = columns[name][index]
+            fields[name] = None if code == MISSING else strings[code]
+        fields['billable'] = columns['billable'][index] if columns['has_billable'][index] else None
+        fields['is_billable'] = bool(columns['is_billable'][index])
+        fields['tags'] = fields['tags'] or ()
+        code = columns['extra'][index]
+        fields['extra'] = None if code == MISSING else codec.loads(strings[code])
+        return TimeEntry(**fields)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_dicts(self):
+        return [entry.to_dict() for entry in self]
+
+
+def decode_entries(entries, output='dict', into=None, interned=None):
+    '''
+    convert report dicts to the requested output: 'dict' (unchanged list), 'entries' (list of TimeEntry)
+    or 'batch' (TimeEntryBatch), appending to `into` when given
+    '''
+    if output == 'dict':
+        into = into if into is not None else []
+        into.extend(entries)
+        return into
+    if output == 'entries':
+        into = into if into is not None else []
+        interned = interned if interned is not None else {}
+        into.extend(TimeEntry.from_dict(entry, interned) for entry in entries)
+        return into
+    if output == 'batch':
+        into = into if into is not None else TimeEntryBatch()
+        into.extend(entries)
+        return into
+    raise ValueError("output must be one of 'dict', 'entries' or 'batch', not %r" % (output,))
@@ -0,0 +1,181 @@
+"""
+Persistent cache for reports of closed periods.
+
+A report whose date window ended long enough ago (settle_days, leaving time
+for late edits) no longer changes, so its response can be kept for good.
+ReportCache stores those responses on disk, gzip compressed, in files named
+after the SHA-256 of the endpoint, the normalized parameters and the
+credentials (content addressed, so equal requests share an entry whatever
+the order of their parameters). The total size is capped, least recently
+used files are evicted first. Reports reaching into the open period are
+never cached; Toggl.getDetailedReportPages splits such a range into a
+cached closed part and a live open part.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+
+# parameters that do not change the content of a report
+IGNORED_PARAMETERS = ('user_agent',)
+
+
+def parse_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def period_end(endpoint, parameters):
+    '''last day covered by a report request, None when it runs up to today'''
+    if endpoint.endswith('/weekly'):
+        if not parameters.get('since'):
+            return None
+        return parse_date(parameters['since']) + timedelta(days=6)
+    if not parameters.get('until'):
+        return None
+    return parse_date(parameters['until'])
+
+
+def split_period(data, closed_until):
+    '''
+    split detailed report parameters running from the closed into the open period,
+    returns (closed part, open part) or None when the range doesn't cross closed_until
+    '''
+    if not data.get('since'):
+        return None
+    since = parse_date(data['since'])
+    until = parse_date(data['until']) if data.get('until') else date.today()
+    if not since <= closed_until < until:
+        return None
+    return (dict(data, until=closed_until.isoformat()),
+            dict(data, since=(closed_until + timedelta(days=1)).isoformat(), until=until.isoformat()))
+
+
+def add_totals(first, second):
+    if first is None or second is None:
+        return first if second is None else second
+    return first + second
+
+
+def merge_detailed(first, second, descending=False):
+    '''
+    merge two detailed reports of consecutive periods (pages already joined),
+    the entries stay in date order, newest first when `descending`
+    '''
+    if descending:
+        first, second = second, first
+    merged = dict(first)
+    data = first['data']
+    if isinstance(data, list):
+        data = data + list(second['data'])
+    else:  # TimeEntryBatch
+        data.extend(second['data'])
+    merged['data'] = data
+    for name in ('total_count', 'total_grand', 'total_billable'):
+        merged[name] = add_totals(first.get(name), second.get(name))
+    currencies = {}
+    for currency in (first.get('total_currencies') or []) + (second.get('total_currencies') or []):
+        name = currency.get('currency')
+        currencies[name] = add_totals(currencies.get(name), currency.get('amount'))
+    merged['total_currencies'] = [{'currency': name, 'amount': amount} for name, amount in currencies.items()]
+    return merged
+
+
+class ReportCache():
+    '''
+    Disk cache of report responses for periods that ended at least `settle_days` ago.
+    :param path: directory holding the cache files, created if needed
+    :param max_bytes: maximum total size of the (compressed) files
+    :param settle_days: days after which a period is considered closed
+    '''
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, settle_days=7):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.settle_days = settle_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(os.path.getsize(file_path) for file_path in self.files())
+
+    def files(self):
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.json.gz'):
+                    yield os.path.join(directory, name)
+
+    def closed_until(self, today=None):
+        '''last day of the closed period'''
+        return (today or date.today()) - timedelta(days=self.settle_days)
+
+    def is_closed(self, endpoint, parameters, today=None):
+        '''whether a report request only covers the closed period'''
+        end = period_end(endpoint, parameters or {})
+        return end is not None and end <= self.closed_until(today)
+
+    def key(self, endpoint, parameters, authorization):
+        normalized = sorted((str(name), str(value)) for name, value in (parameters or {}).items()
+                            if name not in IGNORED_PARAMETERS)
+        credentials = hashlib.sha256((authorization or '').encode('utf-8')).hexdigest()
+        # the standard library encoder, not the codec backend, so the key stays the same when orjson/ujson come
+        # and go and the files written before are still found
+        material = json.dumps([endpoint, normalized, credentials], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def file_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.json.gz')
+
+    def get(self, key):
+        '''return the cached body or None, marking the entry as recently used'''
+        file_path = self.file_path(key)
+        try:
+            with gzip.open(file_path, 'rb') as f:
+                body = f.read()
+            os.utime(file_path)
+        except (OSError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return body
+
+    def set(self, key, body):
+        file_path = self.file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # write to a temporary file and rename it, readers never see half written entries
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(gzip.compress(body))
+        with self._lock:
+            previous = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            os.replace(temporary, file_path)
+            self.size += os.path.getsize(file_path) - previous
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        '''delete least recently used files until the cache is back under 90% of max_bytes'''
+        entries = []
+        for file_path in self.files():
+            stat = os.stat(file_path)
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, file_path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def clear(self):
+        with self._lock:
+            for file_path in list(self.files()):
+                os.remove(file_path)
+            self.size = 0
@@ -0,0 +1,101 @@
+"""
+Priority scheduling of requests sharing one rate limit.
+
+With a bare TokenBucket requests are served in the order they ask for a
+token, so a timer started while a report walk has a dozen page requests
+queued waits behind all of them. PriorityScheduler keeps the requests waiting
+for a token in one queue ordered by priority class, and gives every token, as
+it becomes available, to the oldest request of the most urgent class:
+interactive calls (starting, stopping and reading the running timer) go
+first, bulk work (report pages, bulk updates and deletes) gets whatever
+capacity is left. `headroom` tokens of the burst can be kept away from bulk
+requests, so that a few interactive calls arriving together never wait.
+Requests already sent are not interrupted.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+INTERACTIVE = 'interactive'
+NORMAL = 'normal'
+BULK = 'bulk'
+# priority classes, most urgent first
+PRIORITIES = (INTERACTIVE, NORMAL, BULK)
+
+
+class PriorityStats():
+    '''counters of one priority class'''
+
+    def __init__(self):
+        self.queued = 0  # requests waiting right now
+        self.max_queued = 0
+        self.granted = 0
+        self.waited = 0.0  # total seconds spent in the queue
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        return {'queued': self.queued, 'max_queued': self.max_queued, 'granted': self.granted,
+                'waited': self.waited, 'max_wait': self.max_wait}
+
+
+class PriorityScheduler():
+    '''
+    Hands out the tokens of a rate limiter by priority class, then first come first served.
+    :param headroom: tokens bulk requests leave in the bucket for more urgent ones, at most burst - 1
+    '''
+
+    def __init__(self, headroom=0):
+        if headroom < 0:
+            raise ValueError("headroom can't be negative")
+        self.headroom = headroom
+        self.classes = {name: PriorityStats() for name in PRIORITIES}
+        self._queue = []  # heap of (class rank, arrival number)
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, limiter, priority=NORMAL):
+        '''block until `limiter` grants this request a token, returns the number of seconds waited'''
+        if priority not in self.classes:
+            raise ValueError("priority must be one of %s, not %r" % (', '.join(PRIORITIES), priority))
+        stats = self.classes[priority]
+        # bulk requests only take a token when `reserve` more stay in the bucket
+        reserve = min(self.headroom, limiter.burst - 1) if priority == BULK else 0
+        ticket = (PRIORITIES.index(priority), next(self._arrivals))
+        started = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+            self._condition.notify_all()  # a more urgent request takes over the head of the queue
+            try:
+                while True:
+                    if self._queue[0] != ticket:
+                        self._condition.wait()
+                        continue
+                    delay = limiter.delay(1 + reserve)
+                    if delay <= 0 and limiter.take():
+                        break
+                    self._condition.wait(max(delay, 0.001))
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                stats.queued -= 1
+                self._condition.notify_all()
+            waited = time.monotonic() - started
+            stats.granted += 1
+            stats.waited += waited
+            stats.max_wait = max(stats.max_wait, waited)
+        return waited
+
+    def queued(self, priority=None):
+        '''number of requests waiting for a token, of one class or in total'''
+        with self._condition:
+            if priority is not None:
+                return self.classes[priority].queued
+            return len(self._queue)
+
+    def stats(self):
+        '''per priority class counters: queued, max_queued, granted, waited and max_wait seconds'''
+        with self._condition:
+            return {name: stats.as_dict() for name, stats in self.classes.items()}
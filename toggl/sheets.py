@@ -0,0 +1,144 @@
+"""
+Export detailed reports to a spreadsheet in blocks of rows.
+
+Writing a report cell by cell costs one Sheets API round trip per cell.
+SheetExporter buffers rows and writes every block of `block_size` rows with a
+single range update, the header with one more. export_report() streams the
+entries page by page from Toggl.iterDetailedReport, so neither the report nor
+the sheet contents are held in memory at once. Worksheets are gspread
+Worksheet objects, or anything with the same update(range_name=, values=)
+method such as FakeWorksheet, an in-memory stand-in for offline tests and
+benchmarks.
+"""
+import time
+
+# report fields written by default, one column each
+DEFAULT_COLUMNS = ('user', 'updated', 'start', 'end', 'client', 'project', 'description', 'is_billable', 'billable')
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def cell_name(row, col):
+    '''Excel style name of a cell, 1-based: cell_name(1, 28) == 'AB1' '''
+    letters = []
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters[:0] = LETTERS[rem]
+    return ''.join(letters) + str(row)
+
+
+def range_name(first_row, first_col, last_row, last_col):
+    return '%s:%s' % (cell_name(first_row, first_col), cell_name(last_row, last_col))
+
+
+def cell_value(value):
+    '''a report value as a spreadsheet cell, lists (tags) are joined'''
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ', '.join(str(item) for item in value)
+    return value
+
+
+class SheetExporter():
+    '''
+    Buffers report entries and writes them to a worksheet one block of rows at a time.
+    :param worksheet: gspread Worksheet (or FakeWorksheet)
+    :param columns: report fields to write, in column order
+    :param block_size: rows written per range update
+    :param start_row: sheet row of the header (or of the first entry when header is False)
+    :param header: write the column names above the entries
+    '''
+
+    def __init__(self, worksheet, columns=DEFAULT_COLUMNS, block_size=500, start_row=1, header=True):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.worksheet = worksheet
+        self.columns = tuple(columns)
+        self.block_size = block_size
+        self.next_row = start_row
+        self.rows_written = 0
+        self.updates = 0
+        self._pending = []
+        if header:
+            self.write_block([list(self.columns)])
+
+    def write_block(self, rows):
+        last_row = self.next_row + len(rows) - 1
+        self.worksheet.update(range_name=range_name(self.next_row, 1, last_row, len(self.columns)), values=rows)
+        self.next_row = last_row + 1
+        self.updates += 1
+
+    def add(self, entry):
+        '''queue one report entry dict, writing a block once block_size rows are waiting'''
+        self._pending.append([cell_value(entry.get(column)) for column in self.columns])
+        if len(self._pending) >= self.block_size:
+            self.flush()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def flush(self):
+        '''write the rows still waiting'''
+        if self._pending:
+            self.write_block(self._pending)
+            self.rows_written += len(self._pending)
+            self._pending = []
+
+
+def export_report(toggl, worksheet, data, columns=DEFAULT_COLUMNS, block_size=500, start_row=1, header=True,
+                  prefetch=True):
+    '''
+    Stream a detailed report into a worksheet
+    :param toggl: Toggl object
+    :param data: detailed report parameters
+    :param prefetch: fetch the next report page while the current block is written
+    :return: the SheetExporter, with rows_written and updates counters
+    '''
+    exporter = SheetExporter(worksheet, columns=columns, block_size=block_size, start_row=start_row, header=header)
+    exporter.extend(toggl.iterDetailedReport(data, prefetch=prefetch))
+    exporter.flush()
+    return exporter
+
+
+class FakeWorksheet():
+    '''
+    In-memory worksheet implementing the gspread calls used here.
+    :param latency: seconds every call sleeps, to imitate a Sheets API round trip
+    '''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.cells = {}  # (row, col) -> value
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def parse_cell(name):
+        letters = name.rstrip('0123456789')
+        col = 0
+        for letter in letters:
+            col = col * 26 + LETTERS.index(letter) + 1
+        return int(name[len(letters):]), col
+
+    def update(self, range_name=None, values=None):
+        self._call()
+        first_row, first_col = self.parse_cell(range_name.split(':')[0])
+        for row_offset, row in enumerate(values):
+            for col_offset, value in enumerate(row):
+                self.cells[(first_row + row_offset, first_col + col_offset)] = value
+
+    def update_acell(self, label, value):
+        self._call()
+        self.cells[self.parse_cell(label)] = value
+
+    def get_all_values(self):
+        if not self.cells:
+            return []
+        rows = max(row for row, _ in self.cells)
+        cols = max(col for _, col in self.cells)
+        return [[self.cells.get((row, col), '') for col in range(1, cols + 1)] for row in range(1, rows + 1)]
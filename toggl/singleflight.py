@@ -0,0 +1,72 @@
+"""
+Single-flight coalescing of identical GET requests.
+
+When several threads ask for the same resource at the same time (say a
+dozen handlers calling getClients()), only the first caller sends the
+request. The others wait for it and get the same response body, so they use
+up no rate limit budget. Keys are built from the endpoint, the sorted
+parameters and the credentials, so different accounts never share a
+response.
+"""
+import threading
+
+
+class Call():
+    '''one request in flight and the callers waiting for it'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def request_key(endpoint, parameters, headers):
+    '''identify a GET by endpoint, normalized parameters and Authorization header'''
+    normalized = tuple(sorted((str(name), str(value)) for name, value in (parameters or {}).items()))
+    return endpoint, normalized, headers.get('Authorization')
+
+
+class SingleFlight():
+    '''Runs at most one call per key at a time, concurrent callers with the same key share its result'''
+
+    def __init__(self):
+        self.calls = 0  # calls actually made
+        self.coalesced = 0  # calls answered by another caller's request
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        '''
+        return (func(), False), or (result, True) when the func() already running for `key` provided it,
+        exceptions are shared too
+        '''
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._in_flight[key] = Call()
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._in_flight)}
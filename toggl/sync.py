@@ -0,0 +1,249 @@
+"""
+Incremental synchronisation of detailed report time entries into SQLite.
+
+SyncStore keeps time entries keyed by id together with, per workspace and
+set of users, the latest `updated` timestamp seen (the watermark).
+WorkspaceSync only pulls the report window starting a few days before the
+watermark, so the cost of a refresh follows the amount of recent changes
+rather than the size of the whole history. The report selects entries by
+start date, so edits to entries older than that window are only picked up
+by a full resync, which WorkspaceSync runs every `full_every` days.
+"""
+import json
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+# the reports API refuses ranges longer than a year
+MAX_RANGE_DAYS = 365
+
+
+def parse_timestamp(value):
+    '''parse an ISO 8601 timestamp as sent by Toggl into an aware datetime'''
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def epoch(value):
+    return int(parse_timestamp(value).timestamp()) if value else None
+
+
+class SyncStore():
+    '''
+    SQLite store of time entries and sync watermarks.
+    :param path: database file, ':memory:' for a throwaway store
+    '''
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS time_entries (
+            id INTEGER PRIMARY KEY,
+            workspace_id INTEGER NOT NULL,
+            uid INTEGER,
+            start INTEGER,
+            end INTEGER,
+            updated INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS time_entries_start ON time_entries (workspace_id, start);
+        CREATE TABLE IF NOT EXISTS watermarks (
+            workspace_id INTEGER NOT NULL,
+            users TEXT NOT NULL,
+            updated TEXT NOT NULL,
+            synced_at TEXT NOT NULL,
+            PRIMARY KEY (workspace_id, users)
+        );
+        CREATE TABLE IF NOT EXISTS full_syncs (
+            workspace_id INTEGER NOT NULL,
+            users TEXT NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (workspace_id, users)
+        );
+    '''
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def upsert(self, workspace_id, entries):
+        '''insert or replace time entries, returns how many were written'''
+        rows = [
+            (entry['id'], int(workspace_id), entry.get('uid'), epoch(entry.get('start')), epoch(entry.get('end')),
+             epoch(entry.get('updated')), json.dumps(entry))
+            for entry in entries
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO time_entries VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def delete(self, ids):
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM time_entries WHERE id = ?', [(id,) for id in ids])
+
+    def ids(self, workspace_id, start, end, user_ids=None):
+        '''return the ids of the stored entries of a workspace starting in [start, end) epoch seconds'''
+        query = 'SELECT id, uid FROM time_entries WHERE workspace_id = ? AND start >= ? AND start < ?'
+        with self._lock:
+            rows = self._connection.execute(query, (int(workspace_id), start, end)).fetchall()
+        return set(id for id, uid in rows if not user_ids or uid in user_ids)
+
+    def entries(self, workspace_id=None, since=None, until=None):
+        '''yield stored time entries as dicts in start order, optionally within [since, until) epoch seconds'''
+        query = 'SELECT data FROM time_entries WHERE 1 = 1'
+        parameters = []
+        if workspace_id is not None:
+            query += ' AND workspace_id = ?'
+            parameters.append(int(workspace_id))
+        if since is not None:
+            query += ' AND start >= ?'
+            parameters.append(since)
+        if until is not None:
+            query += ' AND start < ?'
+            parameters.append(until)
+        with self._lock:
+            rows = self._connection.execute(query + ' ORDER BY start, id', parameters).fetchall()
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def count(self, workspace_id=None):
+        query, parameters = 'SELECT COUNT(*) FROM time_entries', ()
+        if workspace_id is not None:
+            query, parameters = query + ' WHERE workspace_id = ?', (int(workspace_id),)
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchone()[0]
+
+    def watermark(self, workspace_id, users=''):
+        '''return the latest `updated` timestamp synced for a workspace and set of users, or None'''
+        with self._lock:
+            row = self._connection.execute('SELECT updated FROM watermarks WHERE workspace_id = ? AND users = ?',
+                                           (int(workspace_id), users)).fetchone()
+        return row[0] if row else None
+
+    def setWatermark(self, workspace_id, users, updated):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                                     (int(workspace_id), users, updated, datetime.now(timezone.utc).isoformat()))
+
+    def lastFullSync(self, workspace_id, users=''):
+        '''return the date of the last full sync of a workspace and set of users, or None'''
+        with self._lock:
+            row = self._connection.execute('SELECT day FROM full_syncs WHERE workspace_id = ? AND users = ?',
+                                           (int(workspace_id), users)).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def setLastFullSync(self, workspace_id, users, day):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO full_syncs VALUES (?, ?, ?)',
+                                     (int(workspace_id), users, day.isoformat()))
+
+
+class WorkspaceSync():
+    '''
+    Keeps a SyncStore up to date with the detailed report of a workspace.
+    :param toggl: Toggl object used to download the report
+    :param store: SyncStore receiving the entries
+    :param workspace_id: workspace to synchronise
+    :param user_ids: optional list of user ids to restrict the report to
+    :param start: date of the oldest entries fetched by the first run, defaults to a year ago
+    :param lookback_days: days before the watermark that are fetched again, to catch late edits
+    :param batch_size: number of entries written per transaction
+    :param full_every: days between full resyncs, which fetch everything since `start` again to catch edits and
+                       deletions of entries older than the look back, None to only ever sync incrementally
+    '''
+
+    def __init__(self, toggl, store, workspace_id, user_ids=None, start=None, lookback_days=7, batch_size=500,
+                 full_every=None):
+        self.toggl = toggl
+        self.store = store
+        self.workspace_id = workspace_id
+        self.user_ids = sorted(int(uid) for uid in user_ids) if user_ids else []
+        self.start = start
+        self.lookback_days = lookback_days
+        self.batch_size = batch_size
+        self.full_every = full_every
+
+    @property
+    def users(self):
+        '''key of the user set in the watermark table'''
+        return ','.join(str(uid) for uid in self.user_ids)
+
+    def fullSyncDue(self, today=None):
+        '''whether the next run is a full one: the first run, then every `full_every` days'''
+        if self.store.watermark(self.workspace_id, self.users) is None:
+            return True
+        if self.full_every is None:
+            return False
+        last = self.store.lastFullSync(self.workspace_id, self.users)
+        return last is None or (today or date.today()) - last >= timedelta(days=self.full_every)
+
+    def window(self, today=None, full=None):
+        '''return the (since, until) dates the next run will fetch, `full` defaults to fullSyncDue()'''
+        until = today or date.today()
+        if full is None:
+            full = self.fullSyncDue(today)
+        watermark = self.store.watermark(self.workspace_id, self.users)
+        if full or watermark is None:
+            since = self.start or until - timedelta(days=MAX_RANGE_DAYS - 1)
+        else:
+            since = parse_timestamp(watermark).date() - timedelta(days=self.lookback_days)
+        return since, until
+
+    def run(self, today=None, full=None):
+        '''
+        fetch the changed window, store it and advance the watermark, returns a dict of statistics
+        An incremental run only sees entries starting in the look back window: the report filters on the start
+        date, so an edit or deletion of an older entry is missed, even though the watermark moves past it. Full
+        runs (every `full_every` days, or full=True) fetch everything since `start` and catch up on those.
+        :param full: force (True) or skip (False) a full resync, decided by fullSyncDue() when None
+        '''
+        if full is None:
+            full = self.fullSyncDue(today)
+        since, until = self.window(today, full)
+        watermark = self.store.watermark(self.workspace_id, self.users)
+        latest = parse_timestamp(watermark) if watermark else None
+        fetched = deleted = 0
+
+        shard_since = since
+        while shard_since <= until:
+            shard_until = min(until, shard_since + timedelta(days=MAX_RANGE_DAYS - 1))
+            data = {'workspace_id': self.workspace_id, 'since': shard_since.isoformat(),
+                    'until': shard_until.isoformat()}
+            if self.user_ids:
+                data['user_ids'] = self.users
+            seen = set()
+            batch = []
+            for entry in self.toggl.iterDetailedReport(data):
+                batch.append(entry)
+                seen.add(entry['id'])
+                if entry.get('updated'):
+                    updated = parse_timestamp(entry['updated'])
+                    latest = updated if latest is None or updated > latest else latest
+                if len(batch) >= self.batch_size:
+                    fetched += self.store.upsert(self.workspace_id, batch)
+                    batch = []
+            fetched += self.store.upsert(self.workspace_id, batch)
+
+            # entries of the window that the report no longer returns were deleted, the report days are in the
+            # user's timezone so the first and last day are left alone rather than guessing the offset
+            window_start = int(datetime.combine(shard_since + timedelta(days=1), datetime.min.time(),
+                                                timezone.utc).timestamp())
+            window_end = int(datetime.combine(shard_until, datetime.min.time(), timezone.utc).timestamp())
+            gone = self.store.ids(self.workspace_id, window_start, window_end, self.user_ids) - seen
+            self.store.delete(gone)
+            deleted += len(gone)
+            shard_since = shard_until + timedelta(days=1)
+
+        watermark = latest.astimezone(timezone.utc).isoformat() if latest is not None else None
+        if watermark is not None:
+            self.store.setWatermark(self.workspace_id, self.users, watermark)
+        if full:
+            self.store.setLastFullSync(self.workspace_id, self.users, until)
+        return {'since': since.isoformat(), 'until': until.isoformat(), 'fetched': fetched, 'deleted': deleted,
+                'watermark': watermark, 'full': full}
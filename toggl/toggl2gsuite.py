@@ -4,6 +4,7 @@ import unittest
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
+from toggl.sheets import export_report
 from toggl.TogglPy import Toggl
 
 # this test demonstrates how to link up the toggl API into a google sheet
@@ -24,24 +25,11 @@ class Toggl2GSuiteTest(unittest.TestCase):
         self.toggl = Toggl()
         self.toggl.setAPIKey(self.api_key)
 
-    # see https://stackoverflow.com/questions/19153462/get-excel-style-column-names-from-column-number
-    LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-
-    @staticmethod
-    def excel_style(row, col):
-        """ Convert given row and column number to an Excel-style cell name. """
-        result = []
-        while col:
-            col, rem = divmod(col - 1, 26)
-            result[:0] = Toggl2GSuiteTest.LETTERS[rem]
-        return ''.join(result) + str(row)
-
     def test_toggl2gsuite(self):
         # have to do this year by year
         data = {
             'workspace_id': os.environ['WORKSPACE_ID'],
         }
-        y = self.toggl.getDetailedReport(data)
 
         credentials = ServiceAccountCredentials.from_json_keyfile_name(
             os.environ['KEYFILE'],
@@ -51,16 +39,8 @@ class Toggl2GSuiteTest(unittest.TestCase):
         sheet = client.open_by_url(os.environ['SHEET_URL'])
         worksheet = sheet.get_worksheet(0)
 
-        wrote_header = False
-        columns_to_write = ['user', 'updated', 'start', 'end', 'client', 'project', 'description', 'is_billable',
-                            'billable']
-        for row_idx, rec in enumerate(y['data']):
-            if not wrote_header:
-                for col_idx, header in enumerate(columns_to_write):
-                    worksheet.update_acell(Toggl2GSuiteTest.excel_style(row_idx + 1, col_idx + 1), header)
-                wrote_header = True
-            for col_idx, header in enumerate(columns_to_write):
-                worksheet.update_acell(Toggl2GSuiteTest.excel_style(row_idx + 2, col_idx + 1), rec[header])
+        # the report is streamed page by page and written 500 rows per range update, header included
+        export_report(self.toggl, worksheet, data, block_size=500)
 
 
 if __name__ == '__main__':
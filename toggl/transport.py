@@ -0,0 +1,458 @@
+"""
+HTTP transport for TogglPy.
+
+Keeps HTTP/1.1 keep-alive connections per host in a bounded pool so that
+consecutive API calls skip the TCP + TLS handshake, and shares a single
+SSL context (and CA bundle) between every connection. Responses are
+requested gzip/deflate compressed and decompressed transparently, and GET
+responses carrying an ETag or Last-Modified validator are kept so that
+repeating the GET sends a conditional request and a 304 Not Modified answer
+is served from memory.
+
+Like urlopen, it connects through the proxies of the environment
+(HTTP_PROXY, HTTPS_PROXY and NO_PROXY, or the system settings), tunneling
+https with CONNECT, and follows redirects.
+"""
+import http.client
+import io
+import select
+import ssl
+import threading
+import time
+import zlib
+from base64 import b64encode
+from collections import OrderedDict, deque
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass, proxy_bypass_environment
+
+try:
+    import certifi
+    cafile = certifi.where()
+except ImportError:
+    cafile = None
+
+# errors meaning a pooled connection was closed by the server while idle
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+# methods sent again on a fresh connection when a reused one turns out to be closed, a POST may have reached the
+# server before the connection dropped and sending it twice could create a duplicate
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE')
+# redirects followed, the others raise HTTPError like urlopen
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class ConnectionFailed(URLError):
+    '''no connection could be opened to the server, the request was never sent'''
+
+
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def default_ssl_context():
+    '''return the SSL context shared by every transport, loading the CA bundle only once'''
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context(cafile=cafile)
+        return _ssl_context
+
+
+class Response():
+    '''
+    a fully read HTTP response
+    :param transferred: body bytes received over the network, less than len(body) when it was compressed
+    :param revalidated: True when the body comes from the ValidatorCache after a 304 Not Modified answer
+    '''
+
+    def __init__(self, url, status, reason, headers, body, transferred=None, revalidated=False):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.transferred = len(body) if transferred is None else transferred
+        self.revalidated = revalidated
+
+    # urllib compatible spelling, postRequest has always returned `.code` for DELETE calls
+    @property
+    def code(self):
+        return self.status
+
+
+def decoder_for(headers):
+    '''return a zlib decompressor for the Content-Encoding of a response, or None when it is not encoded'''
+    encoding = (headers.get('Content-Encoding') or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.decompressobj()
+    return None
+
+
+def decode_body(headers, data):
+    '''decompress a whole response body according to its Content-Encoding'''
+    decoder = decoder_for(headers)
+    if decoder is None:
+        return data
+    return decoder.decompress(data) + decoder.flush()
+
+
+class ValidatorCache():
+    '''
+    GET responses with an ETag or Last-Modified header, per URL and credentials, least recently used dropped first.
+    :param maxsize: maximum number of responses kept
+    :param max_bytes: maximum total size of the kept bodies
+    '''
+
+    def __init__(self, maxsize=256, max_bytes=8 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0  # requests answered 304 and served from the cache
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def conditional_headers(self, key):
+        '''return (cached response, validator headers) or (None, None)'''
+        with self._lock:
+            response = self._responses.get(key)
+            if response is None:
+                return None, None
+            self._responses.move_to_end(key)
+        headers = {}
+        if response.headers.get('ETag'):
+            headers['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = response.headers['Last-Modified']
+        return response, headers
+
+    def store(self, key, response):
+        if not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            return
+        if len(response.body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._responses.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+            self._responses[key] = response
+            self.size += len(response.body)
+            while len(self._responses) > self.maxsize or self.size > self.max_bytes:
+                self.size -= len(self._responses.popitem(last=False)[1].body)
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+            self.size = 0
+
+
+class StreamResponse():
+    '''a response whose body is read in chunks, use it as a context manager or close() it'''
+
+    def __init__(self, url, pool, conn, response):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+
+    @property
+    def code(self):
+        return self.status
+
+    def iter_content(self, chunk_size=65536, decode=True):
+        '''yield the body in chunks, decompressing gzip/deflate content encodings unless decode is False'''
+        decoder = decoder_for(self.headers) if decode else None
+        while True:
+            chunk = self._response.read(chunk_size)
+            if not chunk:
+                break
+            if decoder is not None:
+                chunk = decoder.decompress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if decoder is not None:
+            tail = decoder.flush()
+            if tail:
+                yield tail
+
+    def close(self):
+        '''release the connection, it is only reused when the whole body was read'''
+        if self._conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool.put(self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_dropped(conn):
+    '''whether an idle connection was closed by the server, it is readable then (EOF) while no request is pending'''
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def proxy_headers(proxy):
+    '''return the Proxy-Authorization header for the credentials of a proxy URL, if it has any'''
+    parts = urlsplit(proxy)
+    if parts.username is None:
+        return {}
+    credentials = '%s:%s' % (unquote(parts.username), unquote(parts.password or ''))
+    return {'Proxy-Authorization': 'Basic ' + b64encode(credentials.encode('utf-8')).decode('ascii')}
+
+
+class ConnectionPool():
+    '''
+    idle keep-alive connections for a single scheme/host/port
+    :param proxy: URL of the proxy to connect through, None to connect directly
+    '''
+
+    def __init__(self, scheme, host, port, maxsize=10, idle_timeout=60, timeout=30, ssl_context=None, proxy=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        if proxy is not None and '://' not in proxy:
+            proxy = 'http://' + proxy  # 'host:port' as urllib accepts it
+        self.proxy = proxy
+        # plain http goes to the proxy with the absolute URL, https through a CONNECT tunnel
+        self.forward = proxy is not None and scheme != 'https'
+        self.proxy_headers = proxy_headers(proxy) if proxy is not None else {}
+        self.created = 0  # number of connections opened, handy to observe reuse
+        self._idle = deque()  # (connection, time it was returned to the pool)
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        self.created += 1
+        host, port = self.host, self.port
+        if self.proxy is not None:
+            proxy = urlsplit(self.proxy)
+            host, port = proxy.hostname, proxy.port or 80
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self.ssl_context or default_ssl_context()
+            )
+            if self.proxy is not None:
+                conn.set_tunnel(self.host, self.port, headers=self.proxy_headers)
+            return conn
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def get(self):
+        '''return (connection, reused) taking an idle connection when one is still fresh and open'''
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, returned_at = self._idle.pop()
+                if now - returned_at <= self.idle_timeout and not is_dropped(conn):
+                    return conn, True
+                conn.close()
+            return self._new_connection(), False
+
+    def put(self, conn):
+        '''hand a connection back, closing it if the pool is already full'''
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+
+class HTTPTransport():
+    '''
+    Blocking HTTP client with per host keep-alive connection pools.
+    :param pool_size: maximum number of idle connections kept per host
+    :param idle_timeout: seconds after which an idle connection is discarded instead of reused
+    :param timeout: socket timeout in seconds
+    :param ssl_context: SSL context for https connections, shared module default if not provided
+    :param compress: ask for gzip/deflate compressed responses in request()
+    :param validators: ValidatorCache for conditional GETs, one is created by default, False disables them
+    :param proxies: dict of scheme -> proxy URL (and 'no' -> hosts to reach directly) as urllib's ProxyHandler
+        takes, the proxies of the environment when None, {} to always connect directly
+    :param max_redirects: redirects followed before HTTPError is raised, Authorization is only kept on the same host
+    '''
+
+    def __init__(self, pool_size=10, idle_timeout=60, timeout=30, ssl_context=None, compress=True, validators=None,
+                 proxies=None, max_redirects=10):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.compress = compress
+        self.validators = ValidatorCache() if validators is None else validators or None
+        self.proxies = proxies
+        self.max_redirects = max_redirects
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def proxy_for(self, scheme, host):
+        '''return the URL of the proxy to reach scheme://host through, or None to connect directly'''
+        if self.proxies is None:
+            proxy = getproxies().get(scheme)
+            bypass = proxy and proxy_bypass(host)
+        else:
+            proxy = self.proxies.get(scheme)
+            bypass = proxy and proxy_bypass_environment(host, self.proxies)
+        return None if bypass or not proxy else proxy
+
+    def pool(self, scheme, host, port):
+        '''return the connection pool for a host, creating it on first use'''
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(scheme, host, port, maxsize=self.pool_size, idle_timeout=self.idle_timeout,
+                                      timeout=self.timeout, ssl_context=self.ssl_context,
+                                      proxy=self.proxy_for(scheme, host))
+                self._pools[key] = pool
+            return pool
+
+    def _open(self, method, url, body=None, headers=None):
+        '''send a request and return (pool, connection, response) once the response headers are in'''
+        parts = urlsplit(url)
+        pool = self.pool(parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if pool.forward:
+            path = parts.scheme + '://' + parts.netloc + path
+            headers = dict(headers or {}, **pool.proxy_headers)
+
+        while True:
+            conn, reused = pool.get()
+            if not reused:
+                try:
+                    conn.connect()
+                except OSError as e:
+                    conn.close()
+                    raise ConnectionFailed(e) from e
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                return pool, conn, conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused and method in IDEMPOTENT_METHODS:
+                    continue  # the server dropped an idle connection, retry on a fresh one
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+    def _follow(self, method, url, body=None, headers=None):
+        '''
+        _open() following redirects the way urlopen does: GET and HEAD follow every redirect, POST follows 301, 302
+        and 303 as a GET without body, the others raise HTTPError. Returns (url, pool, connection, response).
+        '''
+        for _ in range(self.max_redirects + 1):
+            pool, conn, resp = self._open(method, url, body=body, headers=headers)
+            location = resp.getheader('Location')
+            if resp.status not in REDIRECT_STATUSES or not location:
+                return url, pool, conn, resp
+            data = resp.read()
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            if method not in ('GET', 'HEAD') and not (method == 'POST' and resp.status in (301, 302, 303)):
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+            target = urljoin(url, location)
+            headers = {name: value for name, value in (headers or {}).items()
+                       if name.lower() not in ('content-type', 'content-length')}
+            if urlsplit(target).netloc != urlsplit(url).netloc:
+                headers.pop('Authorization', None)  # don't hand the credentials to another host
+            method = 'HEAD' if method == 'HEAD' else 'GET'
+            url, body = target, None
+        raise HTTPError(url, resp.status, "too many redirects", resp.headers, io.BytesIO(data))
+
+    def request(self, method, url, body=None, headers=None):
+        '''
+        perform a request and return a Response with a decompressed body,
+        raising urllib's HTTPError for 4xx/5xx statuses just like urlopen does
+        '''
+        headers = dict(headers or {})
+        if self.compress and 'Accept-Encoding' not in headers:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        cached, cache_key = None, None
+        if method == 'GET' and self.validators is not None:
+            cache_key = (url, headers.get('Authorization'))
+            cached, conditions = self.validators.conditional_headers(cache_key)
+            if cached is not None:
+                headers.update(conditions)
+
+        url, pool, conn, resp = self._follow(method, url, body=body, headers=headers)
+        try:
+            data = resp.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+
+        if resp.status == 304 and cached is not None:
+            self.validators.hit()
+            return Response(url, cached.status, cached.reason, cached.headers, cached.body, transferred=len(data),
+                            revalidated=True)
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(decode_body(resp.headers, data)))
+        response = Response(url, resp.status, resp.reason, resp.headers, decode_body(resp.headers, data),
+                            transferred=len(data))
+        if cache_key is not None:
+            self.validators.store(cache_key, response)
+        return response
+
+    def stream(self, method, url, body=None, headers=None):
+        '''
+        perform a request and return a StreamResponse whose body is read incrementally,
+        the connection goes back to the pool once the body is consumed and the response closed
+        '''
+        url, pool, conn, resp = self._follow(method, url, body=body, headers=headers)
+        if resp.status >= 400:
+            data = resp.read()
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+        return StreamResponse(url, pool, conn, resp)
+
+    def close(self):
+        '''close every idle connection'''
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
@@ -0,0 +1,227 @@
+"""
+Running timer watcher.
+
+Polling currentRunningTimeEntry in a tight loop per user costs one request
+per user per loop. TimerWatcher polls each API token on its own schedule:
+the interval starts at min_interval after a change, grows by `backoff` every
+poll that sees nothing new, up to max_interval, and tightens again when a
+running timer approaches the typical length of that user's previous entries.
+Names watching the same token share one poll, every poll goes through the
+token's rate limiter, and on_start / on_stop / on_change callbacks receive
+the differences between two polls. Errors of a poll or of a callback go to
+on_error (or the log) and never stop the polling of other tokens.
+"""
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from toggl import codec
+
+logger = logging.getLogger(__name__)
+
+# time entry fields whose change triggers on_change
+WATCHED_FIELDS = ('description', 'pid', 'tid', 'wid', 'start', 'billable', 'tags')
+
+
+class WatchTarget():
+    '''polling state of one API token'''
+
+    def __init__(self, toggl, due):
+        self.toggl = toggl
+        self.names = []
+        self.current = None  # running time entry dict, or None
+        self.interval = None
+        self.due = due
+        self.started_at = None  # clock time the current entry was first seen
+        self.durations = deque(maxlen=20)  # seconds previous entries were seen running
+        self.polls = 0
+        self.errors = 0
+
+
+class TimerWatcher():
+    '''
+    Watches the running time entry of many Toggl objects (one per API token).
+    :param on_start: callable(name, entry) when a time entry starts running
+    :param on_stop: callable(name, entry) when the running time entry stops, with its last known state
+    :param on_change: callable(name, old_entry, new_entry) when the running time entry is edited
+    :param on_error: callable(name, exception) when a poll or a callback fails, the watcher carries on (backing off
+                     after a failed poll); without it errors are logged
+    :param min_interval: seconds between polls right after a change
+    :param max_interval: longest seconds between two polls of a token
+    :param backoff: factor the interval grows by after each poll without change
+    :param workers: number of tokens polled at the same time
+    :param clock: monotonic clock, in seconds
+    '''
+
+    def __init__(self, on_start=None, on_stop=None, on_change=None, on_error=None, min_interval=5.0,
+                 max_interval=300.0, backoff=1.5, workers=4, clock=time.monotonic):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("min_interval must be positive and at most max_interval")
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.on_change = on_change
+        self.on_error = on_error
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.workers = workers
+        self.clock = clock
+        self.targets = {}  # Authorization header -> WatchTarget
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stop = None
+        self._executor = None
+
+    def watch(self, name, toggl):
+        '''start watching the running time entry of a Toggl object under `name`, polled on the next run'''
+        key = toggl.headers['Authorization']
+        with self._lock:
+            target = self.targets.get(key)
+            if target is None:
+                target = self.targets[key] = WatchTarget(toggl, self.clock())
+            target.names.append(name)
+        self._wakeup.set()
+        return target
+
+    def unwatch(self, name):
+        with self._lock:
+            for key, target in list(self.targets.items()):
+                if name in target.names:
+                    target.names.remove(name)
+                    if not target.names:
+                        del self.targets[key]
+
+    def running(self, name):
+        '''the last seen running time entry of `name`, or None'''
+        with self._lock:
+            for target in self.targets.values():
+                if name in target.names:
+                    return target.current
+        raise KeyError(name)
+
+    def touch(self, name=None):
+        '''poll `name` (or every token) on the next run, e.g. when a change is known to be coming'''
+        now = self.clock()
+        with self._lock:
+            for target in self.targets.values():
+                if name is None or name in target.names:
+                    target.due = now
+        self._wakeup.set()
+
+    def next_due(self):
+        '''clock time of the next poll, None when nothing is watched'''
+        with self._lock:
+            return min((target.due for target in self.targets.values()), default=None)
+
+    def next_interval(self, target, changed, now):
+        '''seconds until the next poll of a target'''
+        if changed or target.interval is None:
+            interval = self.min_interval
+        else:
+            interval = min(target.interval * self.backoff, self.max_interval)
+        if target.current is not None and target.started_at is not None and len(target.durations) >= 3:
+            # tighten around the time this user usually stops a timer
+            expected_end = target.started_at + statistics.median(target.durations)
+            if now < expected_end + self.max_interval:
+                interval = min(interval, max(self.min_interval, (expected_end - now) / 2))
+        return interval
+
+    def poll(self, target):
+        '''fetch the running entry of a target, fire the callbacks and schedule its next poll'''
+        try:
+            entry = codec.loads(target.toggl.currentRunningTimeEntry()).get('data')
+        except Exception as e:
+            now = self.clock()
+            target.errors += 1
+            target.interval = min((target.interval or self.min_interval) * self.backoff, self.max_interval)
+            target.due = now + target.interval
+            for name in list(target.names):
+                self.report_error(name, e)
+            return
+        now = self.clock()
+        target.polls += 1
+        previous = target.current
+        events = []
+        if previous is not None and (entry is None or entry['id'] != previous['id']):
+            events.append((self.on_stop, (previous,)))
+            if target.started_at is not None:
+                target.durations.append(now - target.started_at)
+            target.started_at = None
+        if entry is not None and (previous is None or entry['id'] != previous['id']):
+            events.append((self.on_start, (entry,)))
+            target.started_at = now
+        elif entry is not None and any(entry.get(field) != previous.get(field) for field in WATCHED_FIELDS):
+            events.append((self.on_change, (previous, entry)))
+        target.current = entry
+        target.interval = self.next_interval(target, bool(events), now)
+        target.due = now + target.interval
+        for name in list(target.names):
+            for callback, args in events:
+                self.notify(callback, name, *args)
+
+    def notify(self, callback, name, *args):
+        '''call a user callback, an exception it raises goes to report_error() so that polling carries on'''
+        if callback is None:
+            return
+        try:
+            callback(name, *args)
+        except Exception as e:
+            self.report_error(name, e)
+
+    def report_error(self, name, error):
+        '''pass an error to on_error, or log it'''
+        if self.on_error is not None:
+            try:
+                self.on_error(name, error)
+                return
+            except Exception:
+                logger.exception("TimerWatcher on_error callback failed for %r", name)
+        logger.error("TimerWatcher error for %r", name, exc_info=error)
+
+    def run_once(self):
+        '''poll every target that is due, returns the number of polls'''
+        now = self.clock()
+        with self._lock:
+            due = [target for target in self.targets.values() if target.due <= now]
+        if len(due) > 1 and self.workers > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            list(self._executor.map(self.poll, due))
+        else:
+            for target in due:
+                self.poll(target)
+        return len(due)
+
+    def run(self, stop_event):
+        '''poll until stop_event is set'''
+        while not stop_event.is_set():
+            self._wakeup.clear()
+            try:
+                self.run_once()
+            except Exception:  # keep polling the other tokens whatever happens to one run
+                logger.exception("TimerWatcher run failed")
+            next_due = self.next_due()
+            self._wakeup.wait(self.max_interval if next_due is None else max(0.0, next_due - self.clock()))
+
+    def start(self):
+        '''poll in a background thread until stop() is called'''
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, args=(self._stop,), name='toggl-timer-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None